@@ -0,0 +1,471 @@
+from __future__ import annotations
+import typing
+import pathlib
+import subprocess
+import argparse
+import contextlib
+import dataclasses
+import importlib.util
+import itertools
+import tempfile
+import threading
+import platform
+import statistics
+import datetime
+import json
+import time
+import signal
+import sys
+import os
+
+
+ROOT: pathlib.Path = pathlib.Path(__file__).parent
+PACK_C: pathlib.Path = ROOT / "pack_c.py"
+
+# The cheapest input every backend accepts, all of its time is startup
+MINIMAL_INPUT: typing.Final[str] = "1 0\n"
+
+# Runs a command and reports its peak RSS on stderr once it exits. Exec records the
+# peak of the address space it replaces, so a child forked straight from the harness
+# would inherit the harness's own (NumPy included). This one is forked from a tiny one
+SPAWN_C: typing.Final[str] = """\
+#include <stdio.h>
+#include <unistd.h>
+#include <sys/resource.h>
+#include <sys/wait.h>
+
+int main(int argc, char **argv) {
+    (void)argc;
+    
+    pid_t pid = fork();
+    if (pid == 0) {
+        execvp(argv[1], argv + 1);
+        _exit(127);
+    }
+    
+    int status;
+    struct rusage usage;
+    if (pid < 0 || wait4(pid, &status, 0, &usage) < 0) {
+        return 127;
+    }
+    
+    fprintf(stderr, "\\n%ld\\n", usage.ru_maxrss);
+    return WIFEXITED(status) ? WEXITSTATUS(status) : 128 + WTERMSIG(status);
+}
+"""
+
+
+class Unavailable(Exception):
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class Backend:
+    name: str
+    description: str
+    prepare: typing.Callable[[pathlib.Path], list[str]]
+
+
+def prepare_python(script: str) -> typing.Callable[[pathlib.Path], list[str]]:
+    def prepare(workdir: pathlib.Path) -> list[str]:
+        return [sys.executable, f"{ROOT / script}"]
+    
+    return prepare
+
+
+def prepare_numba(workdir: pathlib.Path) -> list[str]:
+    if importlib.util.find_spec("numba") is None:
+        raise Unavailable("numba isn't installed")
+    
+    return prepare_python("solution.py")(workdir)
+
+
+def prepare_packed(name: str, *flags: str) -> typing.Callable[[pathlib.Path], list[str]]:
+    def prepare(workdir: pathlib.Path) -> list[str]:
+        output: pathlib.Path = workdir / f"{name}.py"
+        subprocess.run(
+            [sys.executable, f"{PACK_C}", f"{ROOT / 'helper.c'}", "-o", f"{output}", *flags],
+            check=True,
+            capture_output=True,
+        )
+        return [sys.executable, f"{output}"]
+    
+    return prepare
+
+
+def prepare_cpp(workdir: pathlib.Path) -> list[str]:
+    executable: pathlib.Path = workdir / "good"
+    if not executable.exists():
+        subprocess.run(
+            ["g++", "-O2", f"{ROOT / 'good.cpp'}", "-o", f"{executable}"],
+            check=True,
+            capture_output=True,
+        )
+    return [f"{executable}"]
+
+
+BACKENDS: typing.Final[dict[str, Backend]] = {
+    backend.name: backend
+    for backend in (
+        Backend("python", "solution.bak.py, plain Python over NumPy arrays", prepare_python("solution.bak.py")),
+        Backend("numba", "solution.py, the lifting tables updated by a numba kernel", prepare_numba),
+        Backend("packed-c", "helper.c packed with pack_c.py", prepare_packed("packed_c")),
+        Backend("packed-c-lct", "helper.c with the link-cut tree engine", prepare_packed("packed_c_lct", "--cflags=-DENGINE=ENGINE_LINK_CUT")),
+        Backend("cpp", "good.cpp built natively, also the reference for the answers", prepare_cpp),
+    )
+}
+
+
+def load_generators() -> dict[str, type]:
+    """
+    The input generators from gen_tests.py, by a short name
+    """
+    
+    spec = importlib.util.spec_from_file_location("gen_tests", ROOT / "gen_tests.py")
+    gen_tests = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gen_tests)
+    
+    return {
+        "dumb": gen_tests.DumbInputGenerator,
+        "improvised": gen_tests.ImprovisedInputGenerator,
+        "smart": gen_tests.SmartInputGenerator,
+        "chain": gen_tests.LongChainInputGenerator,
+        "forest": gen_tests.ForestInputGenerator,
+    }
+
+
+@dataclasses.dataclass(frozen=True)
+class Input:
+    name: str
+    path: pathlib.Path
+    generator: str | None = None
+    nodes_cnt: int | None = None
+    ops_cnt: int | None = None
+    seed: int | None = None
+    
+    @property
+    def parse_path(self) -> pathlib.Path:
+        return self.path.with_suffix(".parse.txt")
+    
+    def write_parse_only(self) -> None:
+        """
+        The same nodes with every operation turned into a query. No edges are ever
+        added, so each answer is -1 from two lookups in singleton sets, and what's
+        left is reading the input and writing one line per operation
+        """
+        
+        with self.path.open() as src, self.parse_path.open("w") as dest:
+            dest.write(next(src))
+            
+            for line in src:
+                if line.strip():
+                    _, node_a, node_b, *_ = line.split()
+                    dest.write(f"2 {node_a} {node_b}\n")
+
+
+def gather_inputs(args: argparse.Namespace, inputs_dir: pathlib.Path) -> list[Input]:
+    inputs: list[Input] = []
+    generators: dict[str, type] | None = None
+    
+    for gen_name, size, seed in itertools.product(args.gen, args.size, args.seed):
+        nodes_cnt, ops_cnt = map(int, size.split(":"))
+        name: str = f"{gen_name}_{nodes_cnt}_{ops_cnt}_{seed}"
+        path: pathlib.Path = inputs_dir / f"{name}.txt"
+        
+        if not path.exists():
+            if generators is None:
+                generators = load_generators()
+            
+            import numpy as np
+            np.random.seed(seed)
+            
+            print(f"Generating {name}", file=sys.stderr)
+            # The generators report progress on stdout
+            with contextlib.redirect_stdout(sys.stderr):
+                generators[gen_name](nodes_cnt, ops_cnt).generate().write(path)
+        
+        inputs.append(Input(name, path, gen_name, nodes_cnt, ops_cnt, seed))
+    
+    for file in args.file:
+        path = pathlib.Path(file)
+        copy: pathlib.Path = inputs_dir / path.name
+        copy.write_bytes(path.read_bytes())
+        inputs.append(Input(path.stem, copy))
+    
+    for item in inputs:
+        if not item.parse_path.exists():
+            item.write_parse_only()
+    
+    return inputs
+
+
+@dataclasses.dataclass
+class Run:
+    status: str
+    wall: float
+    peak_rss: int
+    output: bytes
+
+
+def build_spawner(workdir: pathlib.Path) -> pathlib.Path:
+    source: pathlib.Path = workdir / "spawn.c"
+    executable: pathlib.Path = workdir / "spawn"
+    
+    source.write_text(SPAWN_C)
+    subprocess.run(["gcc", "-O2", f"{source}", "-o", f"{executable}"], check=True)
+    return executable
+
+
+def run_once(spawner: pathlib.Path, command: typing.Sequence[str], input_path: pathlib.Path, timeout: float) -> Run:
+    """
+    Wall time of a single run from spawning to reaping, and its peak RSS
+    """
+    
+    with (
+        input_path.open("rb") as stdin,
+        tempfile.TemporaryFile() as stdout,
+        tempfile.TemporaryFile() as stderr,
+    ):
+        start: float = time.perf_counter()
+        # A session of its own, so a timeout kills the command along with the spawner
+        process = subprocess.Popen([f"{spawner}", *command], stdin=stdin, stdout=stdout, stderr=stderr, start_new_session=True)
+        
+        timer = threading.Timer(timeout, os.killpg, (process.pid, signal.SIGKILL))
+        timer.start()
+        try:
+            process.wait()
+        finally:
+            timer.cancel()
+        
+        wall: float = time.perf_counter() - start
+        
+        stdout.seek(0)
+        output: bytes = stdout.read()
+        stderr.seek(0)
+        report: list[bytes] = stderr.read().split()
+    
+    status: str = "ok"
+    if wall >= timeout:
+        status = "timeout"
+    elif process.returncode != 0:
+        status = "failed"
+    
+    # ru_maxrss is in KiB on Linux, the spawner's report comes last
+    peak_rss: int = int(report[-1]) * 1024 if report and report[-1].isdigit() else 0
+    return Run(status, wall, peak_rss, output)
+
+
+def bench(
+    spawner: pathlib.Path,
+    backend: Backend,
+    command: list[str],
+    item: Input,
+    reference: bytes | None,
+    minimal_path: pathlib.Path,
+    args: argparse.Namespace,
+) -> dict[str, typing.Any]:
+    """
+    Runs the backend on the minimal input, the parse-only one and the full one,
+    args.repeat times each, interleaved. Phases are told apart by the best times:
+    startup is the minimal run, parse is what the parse-only run adds to it, and
+    solve is what the full run adds to that
+    """
+    
+    samples: dict[str, list[float]] = {"minimal": [], "parse": [], "full": []}
+    peak_rss: int = 0
+    status: str = "ok"
+    
+    for _ in range(args.repeat):
+        for kind, path in (("minimal", minimal_path), ("parse", item.parse_path), ("full", item.path)):
+            run: Run = run_once(spawner, command, path, args.timeout)
+            
+            if run.status != "ok":
+                status = run.status
+                break
+            
+            samples[kind].append(run.wall)
+            
+            if kind == "full":
+                peak_rss = max(peak_rss, run.peak_rss)
+                
+                if reference is not None and run.output.split() != reference.split():
+                    status = "wrong"
+        
+        if status in ("failed", "timeout"):
+            break
+    
+    result: dict[str, typing.Any] = dict(
+        backend=backend.name,
+        input=item.name,
+        status=status,
+    )
+    
+    if all(samples.values()):
+        startup: float = min(samples["minimal"])
+        parse: float = min(samples["parse"])
+        full: float = min(samples["full"])
+        
+        result.update(
+            startup=startup,
+            parse=max(0.0, parse - startup),
+            solve=max(0.0, full - parse),
+            total=full,
+            total_median=statistics.median(samples["full"]),
+            peak_rss=peak_rss,
+        )
+    
+    result["samples"] = samples
+    return result
+
+
+def compare(results: list[dict[str, typing.Any]], baseline_path: pathlib.Path) -> None:
+    """
+    Prints how the total times changed against an earlier results file
+    """
+    
+    baseline: dict[tuple[str, str], dict[str, typing.Any]] = {
+        (result["backend"], result["input"]): result
+        for result in json.loads(baseline_path.read_text())["results"]
+    }
+    
+    print(f"\nAgainst {baseline_path}:")
+    for result in results:
+        old = baseline.get((result["backend"], result["input"]))
+        if old is None or "total" not in old or "total" not in result:
+            continue
+        
+        ratio: float = result["total"] / old["total"]
+        print(f"{result['backend']:<14} {result['input']:<28} {old['total']:8.3f}s -> {result['total']:8.3f}s  x{ratio:.2f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Runs each backend over a matrix of generated inputs, timing startup, parsing and solving",
+    )
+    parser.add_argument(
+        "-b", "--backend",
+        action="append",
+        choices=list(BACKENDS),
+        help="Backends to run, can be repeated. Defaults to all of them",
+    )
+    parser.add_argument(
+        "--gen",
+        action="append",
+        choices=["dumb", "improvised", "smart", "chain", "forest"],
+        help="Generators from gen_tests.py, can be repeated. Defaults to forest and chain. "
+             "'dumb' and 'improvised' may add edges that close a cycle, 'smart' takes minutes on large sizes",
+    )
+    parser.add_argument(
+        "--size",
+        action="append",
+        metavar="NODES:OPS",
+        help="Input sizes, can be repeated. Defaults to 2000:2000 and 160000:200000",
+    )
+    parser.add_argument(
+        "--seed",
+        action="append",
+        type=int,
+        help="Generator seeds, can be repeated. Defaults to 0",
+    )
+    parser.add_argument(
+        "--file",
+        action="append",
+        default=[],
+        help="Existing input files to add to the matrix, e.g. big_input.txt",
+    )
+    parser.add_argument(
+        "--inputs-dir",
+        type=pathlib.Path,
+        help="Where generated inputs are kept and reused across runs. Defaults to a temporary directory",
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs of each kind, the best time counts")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds before a run is killed")
+    parser.add_argument("-o", "--output", type=pathlib.Path, help="JSON file to save the results to")
+    parser.add_argument("--baseline", type=pathlib.Path, help="Earlier results to compare the total times with")
+    
+    args = parser.parse_args()
+    args.backend = args.backend or list(BACKENDS)
+    args.gen = args.gen or ["forest", "chain"]
+    args.size = args.size or ["2000:2000", "160000:200000"]
+    args.seed = args.seed or [0]
+    
+    results: list[dict[str, typing.Any]] = []
+    
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        inputs_dir: pathlib.Path = args.inputs_dir or pathlib.Path(workdir)
+        inputs_dir.mkdir(parents=True, exist_ok=True)
+        
+        minimal_path: pathlib.Path = pathlib.Path(workdir) / "minimal.txt"
+        minimal_path.write_text(MINIMAL_INPUT)
+        
+        inputs: list[Input] = gather_inputs(args, inputs_dir)
+        
+        commands: dict[str, list[str]] = {}
+        for name in args.backend:
+            try:
+                commands[name] = BACKENDS[name].prepare(pathlib.Path(workdir))
+            except Unavailable as e:
+                print(f"Skipping {name}: {e}", file=sys.stderr)
+                results.extend(
+                    dict(backend=name, input=item.name, status="skipped", reason=str(e))
+                    for item in inputs
+                )
+        
+        spawner: pathlib.Path = build_spawner(pathlib.Path(workdir))
+        reference_command: list[str] = prepare_cpp(pathlib.Path(workdir))
+        
+        print(f"{'backend':<14} {'input':<28} {'status':<8} {'startup':>8} {'parse':>8} {'solve':>8} {'total':>8} {'rss':>8}")
+        
+        for item in inputs:
+            reference_run: Run = run_once(spawner, reference_command, item.path, args.timeout)
+            reference: bytes | None = reference_run.output if reference_run.status == "ok" else None
+            if reference is None:
+                print(f"The reference {reference_run.status} on {item.name}, answers aren't checked", file=sys.stderr)
+            
+            for name, command in commands.items():
+                result = bench(spawner, BACKENDS[name], command, item, reference, minimal_path, args)
+                results.append(result)
+                
+                if "total" in result:
+                    print(
+                        f"{name:<14} {item.name:<28} {result['status']:<8} "
+                        f"{result['startup']:8.3f} {result['parse']:8.3f} {result['solve']:8.3f} {result['total']:8.3f} "
+                        f"{result['peak_rss'] / 2 ** 20:6.1f}Mi"
+                    )
+                else:
+                    print(f"{name:<14} {item.name:<28} {result['status']:<8}")
+        
+        report: dict[str, typing.Any] = dict(
+            meta=dict(
+                date=datetime.datetime.now().isoformat(timespec="seconds"),
+                python=sys.version.split()[0],
+                platform=platform.platform(),
+                processor=platform.processor(),
+                repeat=args.repeat,
+            ),
+            backends={name: BACKENDS[name].description for name in args.backend},
+            inputs=[
+                dict(
+                    name=item.name,
+                    generator=item.generator,
+                    nodes_cnt=item.nodes_cnt,
+                    ops_cnt=item.ops_cnt,
+                    seed=item.seed,
+                    size=item.path.stat().st_size,
+                )
+                for item in inputs
+            ],
+            results=results,
+        )
+    
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=4) + "\n")
+    
+    if args.baseline is not None:
+        compare(results, args.baseline)
+    
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+from __future__ import annotations
+import typing
+import pathlib
+import subprocess
+import tempfile
+import importlib.util
+import timeit
+import types
+import sys
+import array
+
+
+# A kernel shaped like `eval_path`: two small ints in, one int64 out
+KERNEL_C: typing.Final[str] = """\
+#include <stdint.h>
+#include <stddef.h>
+
+#define EXPORTED __attribute__((used))
+
+EXPORTED int64_t eval_path(int32_t node_a, int32_t node_b) {
+    return (int64_t)node_a * node_b;
+}
+
+EXPORTED int64_t total(const int64_t *data, size_t data_len) {
+    int64_t sum = 0;
+    for (size_t i = 0; i < data_len; ++i) {
+        sum += data[i];
+    }
+    return sum;
+}
+"""
+
+PACK_C: pathlib.Path = pathlib.Path(__file__).parent / "pack_c.py"
+
+CALLS_CNT: typing.Final[int] = 200_000
+
+
+def pack(workdir: pathlib.Path, name: str, *flags: str) -> types.ModuleType:
+    source: pathlib.Path = workdir / "kernel.c"
+    output: pathlib.Path = workdir / f"{name}.py"
+    
+    source.write_text(KERNEL_C)
+    subprocess.check_call([sys.executable, f"{PACK_C}", f"{source}", "-o", f"{output}", "-e", "", *flags])
+    
+    spec = importlib.util.spec_from_file_location(name, output)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(stmt: typing.Callable[[], typing.Any]) -> float:
+    """
+    Returns the best per-call time in nanoseconds
+    """
+    
+    return min(timeit.repeat(stmt, number=CALLS_CNT, repeat=5)) / CALLS_CNT * 1e9
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as workdir:
+        slow = pack(pathlib.Path(workdir), "kernel_ctypes")
+        fast = pack(pathlib.Path(workdir), "kernel_fast", "--fast-call")
+    
+    def python_eval_path(node_a: int, node_b: int) -> int:
+        return node_a * node_b
+    
+    data = array.array("q", range(16))
+    data_wrapped = slow.as_array(data, slow.ctypes.c_int64)
+    
+    results: dict[str, float] = {
+        "python eval_path(3, 5)": measure(lambda: python_eval_path(3, 5)),
+        "ctypes eval_path(3, 5)": measure(lambda: slow.eval_path(3, 5)),
+        "fast eval_path(3, 5)": measure(lambda: fast.eval_path(3, 5)),
+        "ctypes total(buffer)": measure(lambda: slow.total(data)),
+        "ctypes total(as_array)": measure(lambda: slow.total(data_wrapped)),
+        "fast total(buffer)": measure(lambda: fast.total(data)),
+    }
+    
+    for name, ns in results.items():
+        print(f"{name:<28} {ns:8.1f} ns/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -139,11 +139,13 @@ class SmartInputGenerator(DumbInputGenerator):
         return self
 
     def dsu_root(self, node: int) -> int:
-        if self.dsu[node] == node:
-            return node
+        root: int = node
+        while self.dsu[root] != root:
+            root = self.dsu[root]
+        
+        while self.dsu[node] != root:
+            self.dsu[node], node = root, self.dsu[node]
         
-        root: int = self.dsu_root(self.dsu[node])
-        self.dsu[node] = root
         return root
     
     def gen_add(self) -> typing.Sequence[typing.Any]:
@@ -184,9 +186,82 @@ class SmartInputGenerator(DumbInputGenerator):
         )
 
 
+class LongChainInputGenerator(DumbInputGenerator):
+    """
+    Links all the nodes into a single path, then only asks queries.
+    
+    The path is built by joining shorter chains end to end, pairwise,
+    so that the last edge hangs one half of the path under the other,
+    and re-rooting it has to walk n / 2 nodes deep. Joining halves
+    keeps the total work of the solution at O(n log n) nevertheless.
+    
+    Since everything ends up in one component, every query is
+    non-trivial no matter how the answers shift the nodes.
+    """
+    
+    def generate(self) -> InputGenerator:
+        n: int = self.n
+        
+        if self.q < n - 1:
+            raise ValueError("Not enough requests to link all the nodes")
+        
+        chains: list[list[int]] = [[1 + node] for node in np.random.permutation(n)]
+        
+        while len(chains) > 1:
+            joined: list[list[int]] = []
+            
+            for left, right in zip(chains[::2], chains[1::2]):
+                self.add_line(list(map(str, (1, left[-1], right[0], 1 + np.random.randint(10 ** 9)))))
+                joined.append(left + right)
+            
+            if len(chains) % 2:
+                joined.append(chains[-1])
+            
+            chains = joined
+        
+        for _ in range(self.q - (n - 1)):
+            self.add_line(list(map(str, self.gen_eval())))
+        
+        return self
+
+
+class ForestInputGenerator(DumbInputGenerator):
+    """
+    Adds the edges of a random forest in a random order, then only asks queries.
+    
+    The edges of a forest never close a cycle, whatever order they come in,
+    so unlike the dumb generators this one is always valid, and it's fast
+    enough for big inputs. Up to three quarters of the requests are edges, and
+    the rest are queries, which may shift the nodes however they like once
+    nothing is added anymore.
+    """
+    
+    def generate(self) -> InputGenerator:
+        n: int = self.n
+        edges_cnt: int = min(n - 1, self.q * 3 // 4)
+        
+        # A random recursive tree: every node hangs under one that came before it
+        order: np.ndarray = 1 + np.random.permutation(n)
+        parents: np.ndarray = order[(np.random.random(n - 1) * np.arange(1, n)).astype(np.int64)]
+        edges: np.ndarray = np.random.permutation(n - 1)[:edges_cnt]
+        costs: np.ndarray = 1 + np.random.randint(10 ** 9, size=edges_cnt)
+        
+        for edge, cost in zip(edges, costs):
+            self.add_line(list(map(str, (1, parents[edge], order[edge + 1], cost))))
+        
+        for _ in range(self.q - edges_cnt):
+            self.add_line(list(map(str, self.gen_eval())))
+        
+        return self
+
+
 big_inputs: pathlib.Path = pathlib.Path(__file__).parent / "big_input.txt"
 small_inputs: pathlib.Path = pathlib.Path(__file__).parent / "small_input.txt"
+long_chain_inputs: pathlib.Path = pathlib.Path(__file__).parent / "long_chain_input.txt"
+
 
-gen_cls: typing.Type[InputGenerator] = SmartInputGenerator
-# generate(gen_cls, small_inputs, 2000, 2000)
-generate(gen_cls, big_inputs, 160000, 200000)
+if __name__ == "__main__":
+    gen_cls: typing.Type[InputGenerator] = SmartInputGenerator
+    # generate(gen_cls, small_inputs, 2000, 2000)
+    generate(gen_cls, big_inputs, 160000, 200000)
+    # generate(LongChainInputGenerator, long_chain_inputs, 160000, 200000)
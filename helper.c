@@ -1,141 +1,136 @@
 #include <stdint.h>
 #include <stddef.h>
 
+#include "pack/pack.h"
+#include "pack/fastio.h"
+#include "pack/alloc.h"
+#include "pack/vector.h"
 
-#pragma region 'Imported' functions
-#define IMPORTED __attribute__((section(".libc-imp")))
-
-IMPORTED void *(*const volatile malloc)(size_t size) = NULL;
-IMPORTED void *(*const volatile realloc)(void *ptr, size_t size) = NULL;
-IMPORTED void (*const volatile free)(void *ptr) = NULL;
-// IMPORTED void *(*const volatile memcpy)(void *dest, void *src, size_t count) = NULL;
-// #define memcpy __builtin_memcpy
-IMPORTED int (*const volatile printf)(const char *format, ...) = NULL;
-IMPORTED int (*const volatile scanf)(const char *format, ...) = NULL;
-
-#undef IMPORTED
-
-// Hopefully faster...
-static inline void *memcpy(void *dest, void *src, size_t count) {
-    uint32_t *dest_c = dest;
-    uint32_t *src_c = src;
-    count /= sizeof(uint32_t);
-    for (size_t i = 0; i < count; ++i) {
-        dest_c[i] = src_c[i];
-    }
-    return dest;
-}
-#pragma endregion
-
-
-#pragma region Vector but awesome
-struct vector {
-    void *data;
-    size_t size;
-    size_t capacity;
-};
-
-
-#define VECTOR_NEW(TYPE, CAPACITY) (struct vector){     \
-    .data = malloc(sizeof(TYPE) * (CAPACITY)),          \
-    .size = 0,                                          \
-    .capacity = (CAPACITY),                             \
-}
-
-
-#define VECTOR_ENSURE(VECTOR, TYPE, CAPACITY)           \
-    while ((VECTOR).capacity < (CAPACITY)) {            \
-        (VECTOR).capacity *= 2;                         \
-        (VECTOR).data = realloc(                        \
-            (VECTOR).data,                              \
-            sizeof(TYPE) * (VECTOR).capacity            \
-        );                                              \
-    }
-
-
-#define VECTOR_PUSH_BACK(VECTOR, TYPE, VALUE) do {      \
-    VECTOR_ENSURE(VECTOR, TYPE, (VECTOR).size + 1);     \
-    ((TYPE *)(VECTOR).data)[(VECTOR).size++] = (VALUE); \
-} while (0)
-
-
-#define VECTOR_EXTEND(VECTOR, TYPE, OTHER) do {         \
-    VECTOR_ENSURE(VECTOR, TYPE,                         \
-                  (VECTOR).size + (OTHER).size);        \
-    memcpy(                                             \
-        (TYPE *)(VECTOR).data + (VECTOR).size,          \
-        (OTHER).data,                                   \
-        sizeof(TYPE) * (OTHER).size                     \
-    );                                                  \
-    (VECTOR).size += (OTHER).size;                      \
-} while (0)
 
+#pragma region 2D array
+// LAYOUT_LEVEL_MAJOR keeps each level in an array of its own, which is only
+// allocated once some tree is deep enough to need it. LAYOUT_NODE_MAJOR keeps
+// the levels of a node next to each other, in rows that are widened (and
+// copied) as the trees get deeper
+#define LAYOUT_LEVEL_MAJOR 0
+#define LAYOUT_NODE_MAJOR 1
 
-#define VECTOR_ITEM(VECTOR, TYPE, INDEX)                \
-    ((TYPE *)(VECTOR).data)[INDEX]
+#ifndef LAYOUT
+#define LAYOUT LAYOUT_LEVEL_MAJOR
+#endif
 
 
-#define VECTOR_FREE(VECTOR) do {                        \
-    free((VECTOR).data);                                \
-    (VECTOR).data = NULL;                               \
-    (VECTOR).size = 0;                                  \
-    (VECTOR).capacity = 0;                              \
-} while (0)
+#if LAYOUT == LAYOUT_LEVEL_MAJOR
+#define ITEM_2D(ARR, LEVEL, NODE) \
+    ARR[LEVEL][NODE]
+#elif LAYOUT == LAYOUT_NODE_MAJOR
+#define ITEM_2D(ARR, LEVEL, NODE) \
+    ARR[(NODE) * levels_reserved + (LEVEL)]
+#else
+#error "Unknown LAYOUT"
+#endif
 #pragma endregion
 
 
-#pragma region 2D array
-#define NEW_2D(TYPE) \
-    (TYPE *)malloc(sizeof(TYPE) * nodes_cnt * LOG_NODES_CNT)
-
-
-#define ITEM_2D(ARR, LEVEL, NODE) \
-    ARR[(LEVEL) * nodes_cnt + (NODE)]
-
+#pragma region Consts and globals
+// ENGINE_LIFTING merges trees small-to-large and answers queries with binary
+// lifting. ENGINE_LINK_CUT keeps the forest in a link-cut tree, which takes
+// O(log n) amortized per operation and O(n) memory. Pick one with, e.g.
+// `--variant lct=-DENGINE=ENGINE_LINK_CUT`
+#define ENGINE_LIFTING 0
+#define ENGINE_LINK_CUT 1
 
-#define FREE_2D(ARR) \
-    free(ARR)
-#pragma endregion
+#ifndef ENGINE
+#define ENGINE ENGINE_LIFTING
+#endif
 
+#define LOG_NODES_CNT 20
+#define QUERY_BATCH 64
 
-#pragma region Input
-static inline int32_t read_int32() {
-    int32_t value;
-    scanf("%d", &value);
-    return value;
-}
+// Threads that recompute the lifting levels of big trees, 0 for one per CPU.
+// Anything but 1 starts a pool from pack/parallel.h, e.g. `--cflags=-DTHREADS=0`
+#ifndef THREADS
+#define THREADS 1
+#endif
 
+// Nodes per range handed to a thread, smaller trees are updated on the spot
+#define LEVELS_GRAIN 4096
 
-static inline int64_t read_int64() {
-    int64_t value;
-    scanf("%lld", &value);
-    return value;
-}
-#pragma endregion
+#if ENGINE == ENGINE_LIFTING && THREADS != 1
+#include "pack/parallel.h"
+#endif
 
+// The lifting tables store sums of up to nodes_cnt - 1 edge costs. A narrower
+// signed type such as int32_t halves them, but is only safe when max cost *
+// (nodes_cnt - 1) fits in it. Edges that don't make forest_process return -1,
+// and trap anywhere else rather than give wrong answers
+#ifndef COST_T
+#define COST_T int64_t
+#endif
 
-#pragma region Consts and globals
-#define LOG_NODES_CNT 20
+typedef COST_T cost_t;
 
 
 static int32_t nodes_cnt, ops_cnt;
 
+
+#if ENGINE == ENGINE_LIFTING
 static int32_t *dsu_parents;
 static struct vector *dsu_items;
 
 static int32_t *depths;
-static int64_t *costs;
-static int32_t *nexts;
+// The max depth of each tree, stored at its DSU root
+static int32_t *tree_depths;
 static struct vector *neighbours;
 
+#if LAYOUT == LAYOUT_LEVEL_MAJOR
+static cost_t *costs[LOG_NODES_CNT];
+static int32_t *nexts[LOG_NODES_CNT];
+#else
+static cost_t *costs;
+static int32_t *nexts;
+#endif
+static int32_t levels_reserved;
+
+static struct dfs_frame *dfs_stack;
+
 
 struct neighbour {
     int32_t node;
     int64_t cost;
 };
+
+
+struct dfs_frame {
+    int32_t parent;
+    int32_t node;
+    int64_t cost;
+};
+#elif ENGINE == ENGINE_LINK_CUT
+// Node 0 is the null node, forest nodes follow, and then a node per edge,
+// which carries its cost
+#define LCT_NIL 0
+
+
+struct lct_node {
+    int32_t children[2];
+    int32_t parent;
+    int32_t flipped;
+    int64_t cost;
+    int64_t sum;
+};
+
+
+static struct lct_node *lct;
+static int32_t lct_edges_cnt;
+static int32_t *lct_path;
+#else
+#error "Unknown ENGINE"
+#endif
 #pragma endregion
 
 
+#if ENGINE == ENGINE_LIFTING
 #pragma region DSU
 static inline void dsu_init() {
     dsu_parents = malloc(sizeof(*dsu_parents) * nodes_cnt);
@@ -149,24 +144,32 @@ static inline void dsu_init() {
 }
 
 
-// static inline void dsu_free() {
-//     free(dsu_parents);
-//     dsu_parents = NULL;
+static inline void dsu_free() {
+    free(dsu_parents);
+    dsu_parents = NULL;
 
-//     for (int32_t i = 0; i < nodes_cnt; ++i) {
-//         VECTOR_FREE(dsu_items[i]);
-//     }
-//     free(dsu_items);
-//     dsu_items = NULL;
-// }
+    for (int32_t i = 0; i < nodes_cnt; ++i) {
+        VECTOR_FREE(dsu_items[i]);
+    }
+    free(dsu_items);
+    dsu_items = NULL;
+}
 
 
 static inline int32_t dsu_root(int32_t node) {
-    if (dsu_parents[node] == node) {
-        return node;
+    int32_t root = node;
+    while (dsu_parents[root] != root) {
+        root = dsu_parents[root];
     }
 
-    return dsu_parents[node] = dsu_root(dsu_parents[node]);
+    // Path compression, as a second pass instead of on the way back
+    while (dsu_parents[node] != root) {
+        int32_t next = dsu_parents[node];
+        dsu_parents[node] = root;
+        node = next;
+    }
+
+    return root;
 }
 
 
@@ -218,26 +221,210 @@ static inline struct dsu_join_result dsu_join(int32_t node_a, int32_t node_b) {
 
 
 #pragma region Task API
-static inline void dfs_init(int32_t parent, int32_t node, int64_t cost) {
-    depths[node] = depths[parent] + 1;
-    ITEM_2D(nexts, 0, node) = parent;
-    ITEM_2D(costs, 0, node) = cost;
-
-    struct neighbour *end = (struct neighbour *)neighbours[node].data + neighbours[node].size;
-    for (struct neighbour *cur = (struct neighbour *)neighbours[node].data; cur != end; ++cur) {
-        if (cur->node == parent) {
+// Whether sums of up to nodes_cnt - 1 edges of this cost fit in cost_t
+static inline int cost_fits(int64_t cost) {
+    if (sizeof(cost_t) >= sizeof(int64_t)) {
+        return 1;
+    }
+
+    const int64_t max_sum = ((int64_t)1 << (sizeof(cost_t) * 8 - 1)) - 1;
+    const int64_t max_cost = max_sum / (nodes_cnt > 1 ? nodes_cnt - 1 : 1);
+    return cost <= max_cost && cost >= -max_cost;
+}
+
+
+// Jumps of up to `depth` steps only need the levels below its bit width
+static inline int32_t levels_for_depth(int32_t depth) {
+    return depth ? 32 - __builtin_clz(depth) : 1;
+}
+
+
+// Makes sure there is storage for the levels below `levels_cnt`. Levels above
+// those a tree needs are left as they are, and never read for it
+static inline void levels_reserve(int32_t levels_cnt) {
+    if (levels_cnt <= levels_reserved) {
+        return;
+    }
+
+#if LAYOUT == LAYOUT_LEVEL_MAJOR
+    for (; levels_reserved < levels_cnt; ++levels_reserved) {
+        costs[levels_reserved] = malloc(sizeof(cost_t) * nodes_cnt);
+        nexts[levels_reserved] = malloc(sizeof(int32_t) * nodes_cnt);
+    }
+#else
+    // At least doubled, so that the rows are only copied a few times
+    int32_t new_reserved = levels_reserved * 2;
+    if (new_reserved < levels_cnt) {
+        new_reserved = levels_cnt;
+    }
+    if (new_reserved > LOG_NODES_CNT) {
+        new_reserved = LOG_NODES_CNT;
+    }
+
+    cost_t *new_costs = malloc(sizeof(cost_t) * nodes_cnt * new_reserved);
+    int32_t *new_nexts = malloc(sizeof(int32_t) * nodes_cnt * new_reserved);
+
+    for (int32_t node = 0; node < nodes_cnt; ++node) {
+        for (int32_t level = 0; level < levels_reserved; ++level) {
+            new_costs[node * new_reserved + level] = ITEM_2D(costs, level, node);
+            new_nexts[node * new_reserved + level] = ITEM_2D(nexts, level, node);
+        }
+    }
+
+    if (levels_reserved) {
+        free(costs);
+        free(nexts);
+    }
+
+    costs = new_costs;
+    nexts = new_nexts;
+    levels_reserved = new_reserved;
+#endif
+}
+
+
+// Drops every level, whatever size of forest they were allocated for
+static inline void levels_free(void) {
+#if LAYOUT == LAYOUT_LEVEL_MAJOR
+    for (int32_t level = 0; level < levels_reserved; ++level) {
+        free(costs[level]);
+        free(nexts[level]);
+    }
+#else
+    if (levels_reserved) {
+        free(costs);
+        free(nexts);
+    }
+#endif
+
+    levels_reserved = 0;
+}
+
+
+// Frees what engine_init allocated, if it was called, while nodes_cnt is still
+// that of the old forest. forest_init may be called again for another one
+static inline void engine_free() {
+    if (!dsu_parents) {
+        return;
+    }
+
+    dsu_free();
+
+    for (int32_t node = 0; node < nodes_cnt; ++node) {
+        VECTOR_FREE(neighbours[node]);
+    }
+    free(neighbours);
+    free(tree_depths);
+    free(depths);
+    free(dfs_stack);
+
+    levels_free();
+}
+
+
+static inline void engine_init() {
+#if THREADS != 1
+    parallel_init(THREADS);
+#endif
+
+    dsu_init();
+
+    depths = malloc(sizeof(int32_t) * nodes_cnt);
+    tree_depths = malloc(sizeof(int32_t) * nodes_cnt);
+    neighbours = malloc(sizeof(struct vector) * nodes_cnt);
+    dfs_stack = malloc(sizeof(struct dfs_frame) * nodes_cnt);
+
+    levels_reserve(1);
+
+    for (int32_t node = 0; node < nodes_cnt; ++node) {
+        depths[node] = 0;
+        tree_depths[node] = 0;
+        neighbours[node] = VECTOR_NEW(struct neighbour, 8);
+
+        ITEM_2D(nexts, 0, node) = -1;
+        ITEM_2D(costs, 0, node) = 0;
+    }
+}
+
+
+// Hangs the tree of `node` under `parent`. Uses an explicit stack, since the
+// trees can be long paths, and the payload runs on the interpreter's C stack.
+// Every node is pushed once, so nodes_cnt frames are always enough. Returns
+// the max depth reached.
+static inline int32_t dfs_init(int32_t parent, int32_t node, int64_t cost) {
+    int32_t max_depth = 0;
+    struct dfs_frame *top = dfs_stack;
+    *top++ = (struct dfs_frame){.parent = parent, .node = node, .cost = cost};
+
+    while (top != dfs_stack) {
+        struct dfs_frame frame = *--top;
+
+        depths[frame.node] = depths[frame.parent] + 1;
+        if (depths[frame.node] > max_depth) {
+            max_depth = depths[frame.node];
+        }
+
+        ITEM_2D(nexts, 0, frame.node) = frame.parent;
+        ITEM_2D(costs, 0, frame.node) = frame.cost;
+
+        struct neighbour *end = (struct neighbour *)neighbours[frame.node].data + neighbours[frame.node].size;
+        for (struct neighbour *cur = (struct neighbour *)neighbours[frame.node].data; cur != end; ++cur) {
+            if (cur->node == frame.parent) {
+                continue;
+            }
+
+            *top++ = (struct dfs_frame){.parent = frame.node, .node = cur->node, .cost = cur->cost};
+        }
+    }
+
+    return max_depth;
+}
+
+
+// A level of the lifting tables to fill in for some nodes
+struct levels_job {
+    int32_t level;
+    const int32_t *nodes;
+};
+
+
+// Fills in the level for the nodes in [begin, end) of the job from the level below
+static void levels_update(void *ctx, size_t begin, size_t end) {
+    const struct levels_job *job = ctx;
+    const int32_t level = job->level;
+
+    for (size_t i = begin; i < end; ++i) {
+        int32_t node = job->nodes[i];
+        int32_t prev_node = ITEM_2D(nexts, level - 1, node);
+
+        if (prev_node == -1) {
+            ITEM_2D(nexts, level, node) = -1;
             continue;
         }
 
-        dfs_init(node, cur->node, cur->cost);
+        ITEM_2D(nexts, level, node) = ITEM_2D(nexts, level - 1, prev_node);
+        ITEM_2D(costs, level, node) = ITEM_2D(costs, level - 1, node) + ITEM_2D(costs, level - 1, prev_node);
     }
 }
 
 
 static inline void add_edge(int32_t node_a, int32_t node_b, int64_t cost) {
+    // The tables would silently wrap around, see COST_T
+    if (!cost_fits(cost)) {
+        __builtin_trap();
+    }
+
     struct dsu_join_result join_result = dsu_join(node_a, node_b);
+    int32_t *tree_depth = &tree_depths[join_result.root_a];
+    const int32_t old_levels_cnt = levels_for_depth(*tree_depth);
 
-    dfs_init(join_result.node_a, join_result.node_b, cost);
+    const int32_t hung_depth = dfs_init(join_result.node_a, join_result.node_b, cost);
+    if (hung_depth > *tree_depth) {
+        *tree_depth = hung_depth;
+    }
+
+    const int32_t levels_cnt = levels_for_depth(*tree_depth);
+    levels_reserve(levels_cnt);
 
     struct vector *neighbours_a = &neighbours[join_result.node_a];
     struct vector *neighbours_b = &neighbours[join_result.node_b];
@@ -254,29 +441,31 @@ static inline void add_edge(int32_t node_a, int32_t node_b, int64_t cost) {
 
     int32_t *nodes = dsu_items[join_result.root_a].data;
     const size_t given_nodes_cnt = dsu_items[join_result.root_a].size;
-
-    for (int32_t level = 1; level < LOG_NODES_CNT; ++level) {
-        for (size_t i = 0; i < given_nodes_cnt; ++i) {
-            int32_t node = nodes[i];
-            int32_t prev_node = ITEM_2D(nexts, level - 1, node);
-
-            if (prev_node == -1) {
-                ITEM_2D(nexts, level, node) = -1;
-                continue;
-            }
-
-            ITEM_2D(nexts, level, node) = ITEM_2D(nexts, level - 1, prev_node);
-            ITEM_2D(costs, level, node) = ITEM_2D(costs, level - 1, node) + ITEM_2D(costs, level - 1, prev_node);
-        }
+    // The nodes of b were appended after those of a, whose ancestors stay the
+    // same, so they only need the levels their tree didn't have before
+    const size_t hung_nodes_start = given_nodes_cnt - dsu_items[join_result.root_b].size;
+
+    for (int32_t level = 1; level < levels_cnt; ++level) {
+        const size_t start = level < old_levels_cnt ? hung_nodes_start : 0;
+        struct levels_job job = {.level = level, .nodes = nodes + start};
+
+#if THREADS != 1
+        // A level only reads the one below it, so its nodes can be split up
+        parallel_for(given_nodes_cnt - start, LEVELS_GRAIN, levels_update, &job);
+#else
+        levels_update(&job, 0, given_nodes_cnt - start);
+#endif
     }
 }
 
 
 static inline int64_t eval_path(int32_t node_a, int32_t node_b) {
-    if (dsu_root(node_a) != dsu_root(node_b)) {
+    const int32_t root = dsu_root(node_a);
+    if (root != dsu_root(node_b)) {
         return -1;
     }
 
+    const int32_t levels_cnt = levels_for_depth(tree_depths[root]);
     int64_t cost = 0;
 
     if (depths[node_a] < depths[node_b]) {
@@ -288,7 +477,7 @@ static inline int64_t eval_path(int32_t node_a, int32_t node_b) {
     if (depths[node_a] != depths[node_b]) {
         const int32_t delta = depths[node_a] - depths[node_b];
 
-        for (int32_t level = 0; level < LOG_NODES_CNT; ++level) {
+        for (int32_t level = 0; level < levels_cnt; ++level) {
             if ((delta >> level) & 1) {
                 cost += ITEM_2D(costs, level, node_a);
                 node_a = ITEM_2D(nexts, level, node_a);
@@ -300,7 +489,7 @@ static inline int64_t eval_path(int32_t node_a, int32_t node_b) {
         return cost;
     }
 
-    for (int32_t level = LOG_NODES_CNT - 1; level >= 0; --level) {
+    for (int32_t level = levels_cnt - 1; level >= 0; --level) {
         int32_t next_level_a = ITEM_2D(nexts, level, node_a);
         int32_t next_level_b = ITEM_2D(nexts, level, node_b);
 
@@ -319,31 +508,612 @@ static inline int64_t eval_path(int32_t node_a, int32_t node_b) {
 
     return cost + ITEM_2D(costs, 0, node_a) + ITEM_2D(costs, 0, node_b);
 }
+
+
+// Same as eval_path, but for up to QUERY_BATCH independent queries at once.
+// The queries advance level by level together, so the cache misses of
+// different queries on nexts/costs overlap instead of being paid one by one.
+static inline void eval_paths(size_t cnt, const int32_t *nodes_a, const int32_t *nodes_b, int64_t *answers) {
+    int32_t cur_a[QUERY_BATCH];
+    int32_t cur_b[QUERY_BATCH];
+    int32_t deltas[QUERY_BATCH];
+    int32_t levels_cnts[QUERY_BATCH];
+    int64_t path_costs[QUERY_BATCH];
+    int32_t max_delta = 0;
+    int32_t max_levels_cnt = 0;
+
+    for (size_t q = 0; q < cnt; ++q) {
+        int32_t node_a = nodes_a[q];
+        int32_t node_b = nodes_b[q];
+        const int32_t root = dsu_root(node_a);
+
+        if (root != dsu_root(node_b)) {
+            // Equal nodes are left alone by the passes below
+            cur_a[q] = cur_b[q] = node_a;
+            deltas[q] = 0;
+            levels_cnts[q] = 0;
+            path_costs[q] = -1;
+            continue;
+        }
+
+        levels_cnts[q] = levels_for_depth(tree_depths[root]);
+        if (levels_cnts[q] > max_levels_cnt) {
+            max_levels_cnt = levels_cnts[q];
+        }
+
+        if (depths[node_a] < depths[node_b]) {
+            int32_t tmp = node_a;
+            node_a = node_b;
+            node_b = tmp;
+        }
+
+        cur_a[q] = node_a;
+        cur_b[q] = node_b;
+        deltas[q] = depths[node_a] - depths[node_b];
+        path_costs[q] = 0;
+
+        if (deltas[q] > max_delta) {
+            max_delta = deltas[q];
+        }
+    }
+
+    for (int32_t level = 0; level < LOG_NODES_CNT && (max_delta >> level) != 0; ++level) {
+        for (size_t q = 0; q < cnt; ++q) {
+            if ((deltas[q] >> level) & 1) {
+                path_costs[q] += ITEM_2D(costs, level, cur_a[q]);
+                cur_a[q] = ITEM_2D(nexts, level, cur_a[q]);
+            }
+        }
+    }
+
+    for (int32_t level = max_levels_cnt - 1; level >= 0; --level) {
+        for (size_t q = 0; q < cnt; ++q) {
+            if (cur_a[q] == cur_b[q] || level >= levels_cnts[q]) {
+                continue;
+            }
+
+            int32_t next_level_a = ITEM_2D(nexts, level, cur_a[q]);
+            int32_t next_level_b = ITEM_2D(nexts, level, cur_b[q]);
+
+            if (
+                next_level_a == next_level_b ||
+                next_level_a == -1 ||
+                next_level_b == -1
+            ) {
+                continue;
+            }
+
+            path_costs[q] += ITEM_2D(costs, level, cur_a[q]) + ITEM_2D(costs, level, cur_b[q]);
+            cur_a[q] = next_level_a;
+            cur_b[q] = next_level_b;
+        }
+    }
+
+    for (size_t q = 0; q < cnt; ++q) {
+        if (cur_a[q] == cur_b[q]) {
+            answers[q] = path_costs[q];
+            continue;
+        }
+
+        answers[q] = path_costs[q] + ITEM_2D(costs, 0, cur_a[q]) + ITEM_2D(costs, 0, cur_b[q]);
+    }
+}
 #pragma endregion
+#elif ENGINE == ENGINE_LINK_CUT
+#pragma region Link-cut tree
+static inline int lct_is_root(int32_t node) {
+    int32_t parent = lct[node].parent;
+    return lct[parent].children[0] != node && lct[parent].children[1] != node;
+}
 
 
-#pragma region Main
-void solve() {
-    nodes_cnt = read_int32();
-    ops_cnt = read_int32();
+static inline void lct_update(int32_t node) {
+    lct[node].sum = lct[lct[node].children[0]].sum + lct[node].cost + lct[lct[node].children[1]].sum;
+}
 
-    dsu_init();
 
-    depths = malloc(sizeof(int32_t) * nodes_cnt);
-    costs = NEW_2D(int64_t);
-    nexts = NEW_2D(int32_t);
-    neighbours = malloc(sizeof(struct vector) * nodes_cnt);
+static inline void lct_push(int32_t node) {
+    if (!lct[node].flipped) {
+        return;
+    }
 
-    for (int32_t node = 0; node < nodes_cnt; ++node) {
-        depths[node] = 0;
-        neighbours[node] = VECTOR_NEW(struct neighbour, 8);
+    int32_t tmp = lct[node].children[0];
+    lct[node].children[0] = lct[node].children[1];
+    lct[node].children[1] = tmp;
 
-        for (int32_t level = 0; level < LOG_NODES_CNT; ++level) {
-            ITEM_2D(nexts, level, node) = -1;
-            ITEM_2D(costs, level, node) = 0;
+    for (int32_t side = 0; side < 2; ++side) {
+        if (lct[node].children[side] != LCT_NIL) {
+            lct[lct[node].children[side]].flipped ^= 1;
         }
     }
 
+    lct[node].flipped = 0;
+}
+
+
+static inline void lct_rotate(int32_t node) {
+    int32_t parent = lct[node].parent;
+    int32_t grandparent = lct[parent].parent;
+    int32_t side = lct[parent].children[1] == node;
+
+    if (!lct_is_root(parent)) {
+        lct[grandparent].children[lct[grandparent].children[1] == parent] = node;
+    }
+    lct[node].parent = grandparent;
+
+    int32_t child = lct[node].children[side ^ 1];
+    lct[parent].children[side] = child;
+    if (child != LCT_NIL) {
+        lct[child].parent = parent;
+    }
+
+    lct[node].children[side ^ 1] = parent;
+    lct[parent].parent = node;
+
+    lct_update(parent);
+    lct_update(node);
+}
+
+
+static inline void lct_splay(int32_t node) {
+    // Pending flips have to be pushed from the top down before rotating.
+    // The splay tree may be as deep as the whole forest, so no recursion here
+    int32_t path_len = 0;
+    lct_path[path_len++] = node;
+    for (int32_t cur = node; !lct_is_root(cur); cur = lct[cur].parent) {
+        lct_path[path_len++] = lct[cur].parent;
+    }
+    while (path_len) {
+        lct_push(lct_path[--path_len]);
+    }
+
+    while (!lct_is_root(node)) {
+        int32_t parent = lct[node].parent;
+
+        if (!lct_is_root(parent)) {
+            int32_t grandparent = lct[parent].parent;
+            int zig_zig = (lct[parent].children[1] == node) == (lct[grandparent].children[1] == parent);
+            lct_rotate(zig_zig ? parent : node);
+        }
+
+        lct_rotate(node);
+    }
+}
+
+
+// Makes the path from the root to `node` preferred, and `node` the root of its splay tree
+static inline void lct_access(int32_t node) {
+    for (int32_t last = LCT_NIL, cur = node; cur != LCT_NIL; last = cur, cur = lct[cur].parent) {
+        lct_splay(cur);
+        lct[cur].children[1] = last;
+        lct_update(cur);
+    }
+
+    lct_splay(node);
+}
+
+
+static inline void lct_make_root(int32_t node) {
+    lct_access(node);
+    lct[node].flipped ^= 1;
+}
+
+
+static inline int32_t lct_find_root(int32_t node) {
+    lct_access(node);
+
+    for (;;) {
+        lct_push(node);
+        if (lct[node].children[0] == LCT_NIL) {
+            break;
+        }
+        node = lct[node].children[0];
+    }
+
+    lct_splay(node);
+    return node;
+}
+#pragma endregion
+
+
+#pragma region Task API
+// The sums are int64_t here, COST_T is only for the lifting tables
+static inline int cost_fits(int64_t cost) {
+    (void)cost;
+    return 1;
+}
+
+
+static inline void engine_free() {
+    if (!lct) {
+        return;
+    }
+
+    free(lct_path);
+    free(lct);
+    lct = NULL;
+}
+
+
+static inline void engine_init() {
+    int32_t lct_cnt = 2 * nodes_cnt;
+
+    lct = malloc(sizeof(struct lct_node) * lct_cnt);
+    lct_path = malloc(sizeof(int32_t) * lct_cnt);
+    lct_edges_cnt = 0;
+
+    for (int32_t node = 0; node < lct_cnt; ++node) {
+        lct[node] = (struct lct_node){
+            .children = {LCT_NIL, LCT_NIL},
+            .parent = LCT_NIL,
+            .flipped = 0,
+            .cost = 0,
+            .sum = 0,
+        };
+    }
+}
+
+
+// Like with the other engine, the nodes have to be in different trees
+static inline void add_edge(int32_t node_a, int32_t node_b, int64_t cost) {
+    int32_t edge = nodes_cnt + 1 + lct_edges_cnt++;
+    lct[edge].cost = lct[edge].sum = cost;
+
+    // The edge node is a root on its own, so it can be hung under b right away
+    lct_make_root(node_a + 1);
+    lct[node_a + 1].parent = edge;
+    lct[edge].parent = node_b + 1;
+}
+
+
+static inline int64_t eval_path(int32_t node_a, int32_t node_b) {
+    lct_make_root(node_a + 1);
+
+    if (lct_find_root(node_b + 1) != node_a + 1) {
+        return -1;
+    }
+
+    // The splay tree of a now holds exactly the path to b
+    return lct[node_a + 1].sum;
+}
+
+
+static inline void eval_paths(size_t cnt, const int32_t *nodes_a, const int32_t *nodes_b, int64_t *answers) {
+    for (size_t q = 0; q < cnt; ++q) {
+        answers[q] = eval_path(nodes_a[q], nodes_b[q]);
+    }
+}
+#pragma endregion
+#endif
+
+
+#pragma region Batch API
+// Sets up an empty forest of the given size, freeing the previous one. Has to
+// be called before forest_process
+EXPORTED void forest_init(int32_t new_nodes_cnt) {
+    engine_free();
+    nodes_cnt = new_nodes_cnt;
+
+    engine_init();
+}
+
+
+// The operations that every input array has an entry for
+static inline size_t ops_known(size_t ops_len, size_t nodes_a_len, size_t nodes_b_len, size_t op_costs_len) {
+    size_t known = ops_len;
+    known = nodes_a_len < known ? nodes_a_len : known;
+    known = nodes_b_len < known ? nodes_b_len : known;
+    known = op_costs_len < known ? op_costs_len : known;
+
+    return known;
+}
+
+
+// Whether every node that the operations name is one of the forest's
+static inline int ops_valid(
+    const int32_t *ops, size_t ops_len, const int32_t *nodes_a, const int32_t *nodes_b, int32_t forest_nodes_cnt
+) {
+    for (size_t iter = 0; iter < ops_len; ++iter) {
+        if (ops[iter] != 1 && ops[iter] != 2) {
+            continue;
+        }
+
+        if (
+            nodes_a[iter] < 0 || nodes_a[iter] >= forest_nodes_cnt ||
+            nodes_b[iter] < 0 || nodes_b[iter] >= forest_nodes_cnt
+        ) {
+            return 0;
+        }
+    }
+
+    return 1;
+}
+
+
+// Whether the engine can take the cost of every edge, see COST_T
+static inline int costs_valid(const int32_t *ops, size_t ops_len, const int64_t *op_costs) {
+    for (size_t iter = 0; iter < ops_len; ++iter) {
+        if (ops[iter] == 1 && !cost_fits(op_costs[iter])) {
+            return 0;
+        }
+    }
+
+    return 1;
+}
+
+
+// Applies an already decoded (0-based, no answer-dependent shifts) stream of
+// operations: op 1 adds the edge (a, b) of the given cost, op 2 asks for the
+// path cost between a and b. Answers to op 2 are stored to `answers` in order,
+// their count is returned. Runs of consecutive queries are answered together.
+// Only the operations all the inputs cover are applied, and the stream stops
+// at the first query that doesn't fit into `answers`. Returns -1 and applies
+// nothing if a node is out of the forest, an edge cost doesn't fit COST_T, or
+// forest_init hasn't been called.
+EXPORTED int64_t forest_process(
+    const int32_t *ops, size_t ops_len,
+    const int32_t *nodes_a, size_t nodes_a_len,
+    const int32_t *nodes_b, size_t nodes_b_len,
+    const int64_t *op_costs, size_t op_costs_len,
+    int64_t *answers, size_t answers_len
+) {
+    ops_len = ops_known(ops_len, nodes_a_len, nodes_b_len, op_costs_len);
+    if (!ops_valid(ops, ops_len, nodes_a, nodes_b, nodes_cnt) || !costs_valid(ops, ops_len, op_costs)) {
+        return -1;
+    }
+
+    size_t answers_cnt = 0;
+
+    for (size_t iter = 0; iter < ops_len;) {
+        if (ops[iter] == 1) {
+            add_edge(nodes_a[iter], nodes_b[iter], op_costs[iter]);
+            ++iter;
+            continue;
+        }
+
+        if (ops[iter] != 2) {
+            ++iter;
+            continue;
+        }
+
+        const size_t run_max = answers_len - answers_cnt < QUERY_BATCH ? answers_len - answers_cnt : QUERY_BATCH;
+        if (!run_max) {
+            break;
+        }
+
+        size_t run_end = iter;
+        while (run_end < ops_len && run_end - iter < run_max && ops[run_end] == 2) {
+            ++run_end;
+        }
+
+        eval_paths(run_end - iter, nodes_a + iter, nodes_b + iter, answers + answers_cnt);
+        answers_cnt += run_end - iter;
+        iter = run_end;
+    }
+
+    return answers_cnt;
+}
+#pragma endregion
+
+
+#pragma region Offline API
+// When the whole stream is known up front, every query can be answered on the
+// final forest: a path that exists when it is asked never changes later, and a
+// DSU replayed in order tells whether it exists yet. Path costs then come from
+// prefix sums from the roots and Tarjan's offline LCA, which is O((n + q) log n)
+// in total and walks the memory mostly in order. Doesn't touch the engine.
+static inline int32_t offline_root(int32_t *parents, int32_t node) {
+    int32_t root = node;
+    while (parents[root] != root) {
+        root = parents[root];
+    }
+
+    while (parents[node] != root) {
+        int32_t next = parents[node];
+        parents[node] = root;
+        node = next;
+    }
+
+    return root;
+}
+
+
+// Same contract as forest_process, but for a forest of forest_nodes_cnt nodes
+// of its own. forest_init isn't needed
+EXPORTED int64_t forest_process_offline(
+    int32_t forest_nodes_cnt,
+    const int32_t *ops, size_t ops_len,
+    const int32_t *nodes_a, size_t nodes_a_len,
+    const int32_t *nodes_b, size_t nodes_b_len,
+    const int64_t *op_costs, size_t op_costs_len,
+    int64_t *answers, size_t answers_len
+) {
+    const int32_t cnt = forest_nodes_cnt;
+    ops_len = ops_known(ops_len, nodes_a_len, nodes_b_len, op_costs_len);
+    if (cnt < 0 || !ops_valid(ops, ops_len, nodes_a, nodes_b, cnt)) {
+        return -1;
+    }
+
+    int32_t *parents = malloc(sizeof(int32_t) * cnt);
+    int32_t *sizes = malloc(sizeof(int32_t) * cnt);
+    size_t *edge_starts = malloc(sizeof(size_t) * (cnt + 1));
+    size_t *query_starts = malloc(sizeof(size_t) * (cnt + 1));
+
+    for (int32_t node = 0; node < cnt; ++node) {
+        parents[node] = node;
+        sizes[node] = 1;
+    }
+    for (int32_t node = 0; node <= cnt; ++node) {
+        edge_starts[node] = query_starts[node] = 0;
+    }
+
+    // The pass in order: connectivity at query time, and the degrees. Queries
+    // that will be answered on the final forest are marked with 0 for now
+    size_t answers_cnt = 0;
+
+    for (size_t iter = 0; iter < ops_len; ++iter) {
+        const int32_t node_a = nodes_a[iter];
+        const int32_t node_b = nodes_b[iter];
+
+        if (ops[iter] == 1) {
+            int32_t root_a = offline_root(parents, node_a);
+            int32_t root_b = offline_root(parents, node_b);
+
+            if (sizes[root_a] < sizes[root_b]) {
+                int32_t tmp = root_a;
+                root_a = root_b;
+                root_b = tmp;
+            }
+
+            parents[root_b] = root_a;
+            sizes[root_a] += sizes[root_b];
+
+            ++edge_starts[node_a + 1];
+            ++edge_starts[node_b + 1];
+        } else if (ops[iter] == 2) {
+            // The later passes stop here as well
+            if (answers_cnt == answers_len) {
+                ops_len = iter;
+                break;
+            }
+
+            if (offline_root(parents, node_a) != offline_root(parents, node_b)) {
+                answers[answers_cnt++] = -1;
+                continue;
+            }
+
+            answers[answers_cnt++] = 0;
+            ++query_starts[node_a + 1];
+            ++query_starts[node_b + 1];
+        }
+    }
+
+    for (int32_t node = 0; node < cnt; ++node) {
+        edge_starts[node + 1] += edge_starts[node];
+        query_starts[node + 1] += query_starts[node];
+    }
+
+    // Adjacency and per-node query lists of the final forest, as flat arrays
+    int32_t *edge_nodes = malloc(sizeof(int32_t) * edge_starts[cnt]);
+    int64_t *edge_costs = malloc(sizeof(int64_t) * edge_starts[cnt]);
+    int32_t *query_nodes = malloc(sizeof(int32_t) * query_starts[cnt]);
+    size_t *query_ids = malloc(sizeof(size_t) * query_starts[cnt]);
+    size_t *edge_cursors = malloc(sizeof(size_t) * cnt);
+    size_t *query_cursors = malloc(sizeof(size_t) * cnt);
+
+    for (int32_t node = 0; node < cnt; ++node) {
+        edge_cursors[node] = edge_starts[node];
+        query_cursors[node] = query_starts[node];
+    }
+
+    for (size_t iter = 0, answer = 0; iter < ops_len; ++iter) {
+        const int32_t node_a = nodes_a[iter];
+        const int32_t node_b = nodes_b[iter];
+
+        if (ops[iter] == 1) {
+            edge_nodes[edge_cursors[node_a]] = node_b;
+            edge_costs[edge_cursors[node_a]++] = op_costs[iter];
+            edge_nodes[edge_cursors[node_b]] = node_a;
+            edge_costs[edge_cursors[node_b]++] = op_costs[iter];
+        } else if (ops[iter] == 2) {
+            if (answers[answer] == 0) {
+                query_nodes[query_cursors[node_a]] = node_b;
+                query_ids[query_cursors[node_a]++] = answer;
+                query_nodes[query_cursors[node_b]] = node_a;
+                query_ids[query_cursors[node_b]++] = answer;
+            }
+
+            ++answer;
+        }
+    }
+
+    // Tarjan's LCA with an explicit stack. A node's set is merged into its
+    // parent's once its subtree is done, so the root of a visited node's set is
+    // its deepest ancestor still on the stack. Unvisited nodes are at -1
+    int32_t *lca_parents = parents;
+    int64_t *dists = malloc(sizeof(int64_t) * cnt);
+    int32_t *stack = sizes;
+
+    for (int32_t node = 0; node < cnt; ++node) {
+        lca_parents[node] = -1;
+        edge_cursors[node] = edge_starts[node];
+    }
+
+    for (int32_t tree_root = 0; tree_root < cnt; ++tree_root) {
+        if (lca_parents[tree_root] != -1) {
+            continue;
+        }
+
+        int32_t stack_len = 0;
+        int32_t node = tree_root;
+        dists[node] = 0;
+
+        for (;;) {
+            // Entering `node`
+            lca_parents[node] = node;
+            stack[stack_len++] = node;
+
+            for (size_t i = query_starts[node]; i < query_starts[node + 1]; ++i) {
+                const int32_t other = query_nodes[i];
+
+                if (lca_parents[other] != -1) {
+                    const int32_t lca = offline_root(lca_parents, other);
+                    answers[query_ids[i]] = dists[node] + dists[other] - 2 * dists[lca];
+                }
+            }
+
+            // Going up until some node on the stack has an unvisited child
+            node = -1;
+
+            while (stack_len) {
+                const int32_t top = stack[stack_len - 1];
+
+                while (edge_cursors[top] < edge_starts[top + 1] && lca_parents[edge_nodes[edge_cursors[top]]] != -1) {
+                    ++edge_cursors[top];
+                }
+
+                if (edge_cursors[top] < edge_starts[top + 1]) {
+                    node = edge_nodes[edge_cursors[top]];
+                    dists[node] = dists[top] + edge_costs[edge_cursors[top]];
+                    ++edge_cursors[top];
+                    break;
+                }
+
+                if (--stack_len) {
+                    lca_parents[top] = stack[stack_len - 1];
+                }
+            }
+
+            if (node == -1) {
+                break;
+            }
+        }
+    }
+
+    free(dists);
+    free(query_cursors);
+    free(edge_cursors);
+    free(query_ids);
+    free(query_nodes);
+    free(edge_costs);
+    free(edge_nodes);
+    free(query_starts);
+    free(edge_starts);
+    free(sizes);
+    free(parents);
+
+    return answers_cnt;
+}
+#pragma endregion
+
+
+#pragma region Main
+void solve() {
+    int32_t new_nodes_cnt = read_int32();
+    ops_cnt = read_int32();
+
+    forest_init(new_nodes_cnt);
+
     int64_t ans = 0;
 
     for (int32_t iter = 0; iter < ops_cnt; ++iter) {
@@ -363,13 +1133,49 @@ void solve() {
 
         case 2: {
             ans = eval_path(i, j);
-            printf("%lld\n", ans);
+            write_int64(ans);
+            write_char('\n');
             // Should always be non-negative this way
             ans = (ans + nodes_cnt) % nodes_cnt;
         } break;
         }
     }
 
+    output_flush();
+
     // dsu_free();
 }
+
+
+// Same input as solve(), except that the nodes aren't shifted by the previous
+// answer, so the whole stream can be read before answering. Pack with
+// `-e solve_offline` to use it
+void solve_offline() {
+    int32_t new_nodes_cnt = read_int32();
+    ops_cnt = read_int32();
+
+    int32_t *ops = malloc(sizeof(int32_t) * ops_cnt);
+    int32_t *nodes_a = malloc(sizeof(int32_t) * ops_cnt);
+    int32_t *nodes_b = malloc(sizeof(int32_t) * ops_cnt);
+    int64_t *op_costs = malloc(sizeof(int64_t) * ops_cnt);
+    int64_t *answers = malloc(sizeof(int64_t) * ops_cnt);
+
+    for (int32_t iter = 0; iter < ops_cnt; ++iter) {
+        ops[iter] = read_int32();
+        nodes_a[iter] = read_int32() % new_nodes_cnt;
+        nodes_b[iter] = read_int32() % new_nodes_cnt;
+        op_costs[iter] = ops[iter] == 1 ? read_int64() : 0;
+    }
+
+    int64_t answers_cnt = forest_process_offline(
+        new_nodes_cnt, ops, ops_cnt, nodes_a, ops_cnt, nodes_b, ops_cnt, op_costs, ops_cnt, answers, ops_cnt
+    );
+
+    for (int64_t i = 0; i < answers_cnt; ++i) {
+        write_int64(answers[i]);
+        write_char('\n');
+    }
+
+    output_flush();
+}
 #pragma endregion
@@ -8,7 +8,25 @@ import contextlib
 import itertools
 import re
 import shlex
+import struct
 import zlib
+import lzma
+import bz2
+import base64
+import functools
+import sys
+import os
+import io
+import glob
+import time
+import concurrent.futures
+import json
+import hashlib
+import shutil
+import tempfile
+import dataclasses
+import keyword
+import traceback
 
 
 parser = argparse.ArgumentParser(
@@ -17,21 +35,103 @@ parser = argparse.ArgumentParser(
 
 parser.add_argument(
     "c_source",
-    type=pathlib.Path,
-    help="Path to the C source file",
+    type=str,
+    nargs="+",
+    help="Paths or glob patterns of the C source files, which are packed concurrently",
 )
 
 parser.add_argument(
     "-o", "--output",
     type=pathlib.Path,
-    help="Path to the output Python file",
+    help="Path to the output Python file, or the output directory when packing several files. "
+         "Defaults to the source path with a '.py' suffix",
+)
+
+parser.add_argument(
+    "-j", "--jobs",
+    type=int,
+    default=os.cpu_count(),
+    help="How many sources to pack at once, defaults to the number of CPUs",
+)
+
+parser.add_argument(
+    "--variant",
+    type=str,
+    action="append",
+    default=[],
+    help="'NAME=CFLAGS': also pack every source with these additional flags into '<source>.NAME.py'",
+)
+
+parser.add_argument(
+    "--watch",
+    action="store_true",
+    help="Keep running and re-pack a source whenever it or a header it includes changes",
 )
 
 parser.add_argument(
     "-e", "--entry-point",
     type=str,
     default="solve",
-    help="Name of the entry point function, defaults to 'solve'. The signature must be 'void()'",
+    help="Name of the entry point function, defaults to 'solve'. The signature must be 'void()'. "
+         "Pass an empty string to only expose the exported functions",
+)
+
+parser.add_argument(
+    "-x", "--export",
+    type=str,
+    action="append",
+    default=[],
+    help="Name of an additional function to expose as a Python callable. "
+         "Its signature is parsed from the source. Functions marked with "
+         "'EXPORTED' in the source are exported automatically",
+)
+
+parser.add_argument(
+    "--fast-call",
+    action="store_true",
+    help="Expose the exported functions as native builtins through generated "
+         "METH_FASTCALL shims instead of ctypes, cutting the per-call overhead",
+)
+
+parser.add_argument(
+    "--nogil",
+    action="store_true",
+    help="Release the GIL while the fast-call shims run the C function, so other Python "
+         "threads keep running. Calls through ctypes always release it",
+)
+
+parser.add_argument(
+    "--heap-size",
+    type=lambda size: parse_size(size),
+    default=None,
+    help="Serve malloc/realloc/free from a bump allocator over one mapping of this size "
+         "(e.g. '512M'), reserved by the stub and touched lazily, instead of libc. "
+         "Needs 'pack/alloc.h'",
+)
+
+parser.add_argument(
+    "--isa",
+    choices=["native", "x86-64", "x86-64-v2", "x86-64-v3", "x86-64-v4"],
+    action="append",
+    default=[],
+    help="Target instruction set, defaults to 'native' (the machine that packs). Repeat it to "
+         "pack a build for every given x86-64 level, the stub runs the best one the CPU supports",
+)
+
+parser.add_argument(
+    "--pgo",
+    type=pathlib.Path,
+    default=None,
+    help="Path to a training input. The entry point is first built as a normal instrumented "
+         "executable and run on it, and the collected profile then guides the optimization",
+)
+
+parser.add_argument(
+    "--exec-mode",
+    action="store_true",
+    help="Build a regular static executable with its own main() instead of a payload (C++ "
+         "sources go through g++), which the Python file writes to a memfd and executes. "
+         "Stdin, stdout and the exit status are the program's own",
 )
 
 parser.add_argument(
@@ -42,154 +142,1988 @@ parser.add_argument(
 )
 
 parser.add_argument(
-    "-c", "--compress",
+    "--no-cache",
     action="store_true",
-    help="Compress the function code with zlib",
+    help="Always run gcc instead of reusing a previous build of the same inputs",
+)
+
+parser.add_argument(
+    "--cache-size",
+    type=lambda size: parse_size(size),
+    default="256M",
+    help="Evict the least recently used builds once the cache grows past this size, defaults to '256M'",
+)
+
+parser.add_argument(
+    "-c", "--compress",
+    action="store_const",
+    dest="codec",
+    const="zlib",
+    default="none",
+    help="Compress the function code with zlib, same as '--codec zlib'",
+)
+
+parser.add_argument(
+    "--codec",
+    choices=["none", "zlib", "lzma", "bz2"],
+    default="none",
+    help="Compression applied to the function code, defaults to 'none'",
+)
+
+parser.add_argument(
+    "--encoding",
+    choices=["repr", "b85", "b64"],
+    default="repr",
+    help="How the (possibly compressed) function code is written into the Python file: "
+         "as a bytes literal, or as base85/base64 text. Defaults to 'repr'",
+)
+
+parser.add_argument(
+    "--auto",
+    choices=["size", "time"],
+    default=None,
+    help="Try every encoding and codec, print the tradeoffs and pick the combination "
+         "with the smallest output or the fastest measured load. Overrides --encoding and --codec",
 )
 
 
-env = jinja2.Environment()
+CACHE_DIR: pathlib.Path = pathlib.Path(os.environ.get("XDG_CACHE_HOME") or "~/.cache").expanduser() / "pack_c"
+BUILD_CACHE_DIR: pathlib.Path = CACHE_DIR / "builds"
+TEMPLATE_CACHE_DIR: pathlib.Path = CACHE_DIR / "templates"
+
+TEMPLATE_SOURCES: dict[str, str] = {}
+
+
+def load_template(name: str, source: str) -> jinja2.Template:
+    """
+    Compiling the templates takes longer than packing a cached build, so their bytecode is
+    cached too. Jinja checks it against the source, edits to the templates are picked up
+    """
+    
+    TEMPLATE_SOURCES[name] = source
+    return env.get_template(name)
+
+
+try:
+    TEMPLATE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    bytecode_cache: jinja2.BytecodeCache | None = jinja2.FileSystemBytecodeCache(str(TEMPLATE_CACHE_DIR))
+except OSError:
+    bytecode_cache = None
+
+env = jinja2.Environment(
+    loader=jinja2.FunctionLoader(TEMPLATE_SOURCES.get),
+    bytecode_cache=bytecode_cache,
+)
 env.filters["repr"] = repr
 env.filters["hex_4"] = lambda s: f"{s:#x}"
-env.filters["zlib_compress"] = zlib.compress
 
 
-TEMPLATE_PY: typing.Final[jinja2.Template] = env.from_string("""\
+TEMPLATE_PY: typing.Final[jinja2.Template] = load_template("stub.py", """\
 from __future__ import annotations
 import typing
 import sys
 import ctypes
 import struct
 import mmap
-{%- if compress %}
-import zlib
+{%- if variants[0].fini_offs %}
+import atexit
 {%- endif %}
+{%- for module in modules %}
+import {{ module }}
+{%- endfor %}
+{%- macro variant_globals(variant) %}
+func_code: bytes = {{ variant.payload.literal }}
 
 
-func_code: bytearray = bytearray(
-    {% if compress -%}
-    zlib.decompress(
-        {{ func_code | zlib_compress | repr }}
-    )
-    {%- else -%}
-    {{ func_code | repr }}
-    {%- endif %}
+{{ variant.payload.pieces_source }}
+
+# (offset in the decoded func_code, offset in the mapping, size) of the stored part of each region.
+# Page alignment gaps, trailing zeros and .bss aren't stored, mmap leaves them zero-filled
+func_chunks: tuple[tuple[int, int, int], ...] = (
+    {%- for src, dest, size in variant.func_chunks %}
+    ({{ src | hex_4 }}, {{ dest | hex_4 }}, {{ size | hex_4 }}),
+    {%- endfor %}
 )
 
-libc_relocs: dict[str, int] = dict(
-    {%- for name, offs in libc_relocs.items() %}
+func_size: int = {{ variant.func_size | hex_4 }}
+
+# (start, end, protection) of text, rodata and data
+func_regions: tuple[tuple[int, int, int], ...] = (
+    (0x0, {{ variant.rodata_offs | hex_4 }}, mmap.PROT_READ | mmap.PROT_EXEC),
+    ({{ variant.rodata_offs | hex_4 }}, {{ variant.data_offs | hex_4 }}, mmap.PROT_READ),
+    ({{ variant.data_offs | hex_4 }}, func_size, mmap.PROT_READ | mmap.PROT_WRITE),
+)
+
+# (library, offset of its pointer table, symbols in table order), None is the interpreter itself
+func_imports: tuple[tuple[str | None, int, tuple[bytes, ...]], ...] = (
+    {%- for table in variant.imports %}
+    ({{ '"%s"' % table.library if table.library is not none else "None" }}, {{ table.offs | hex_4 }}, (
+        {%- for name in table.names %}
+        b"{{ name }}",
+        {%- endfor %}
+    )),
+    {%- endfor %}
+)
+{%- if variant.export_offs %}
+
+func_exports: dict[str, int] = dict(
+    {%- for name, offs in variant.export_offs.items() %}
     {{ name }}={{ offs | hex_4 }},
     {%- endfor %}
 )
+{%- endif %}
+{%- if variant.init_offs or variant.fini_offs %}
+
+# Static constructors and destructors, in the order they run
+func_inits: tuple[int, ...] = ({% for offs in variant.init_offs %}{{ offs | hex_4 }}, {% endfor %})
+func_finis: tuple[int, ...] = ({% for offs in variant.fini_offs %}{{ offs | hex_4 }}, {% endfor %})
+{%- endif %}
+{%- if variant.heap_offs is not none %}
+
+heap_offs: int = {{ variant.heap_offs | hex_4 }}
+{%- endif %}
+{%- if variant.func_offs is not none %}
+
+func_offs: int = {{ variant.func_offs | hex_4 }}
+{%- endif %}
+{%- endmacro %}
+
+{% if variants[0].isa == "native" %}
+{{ variant_globals(variants[0]) | trim }}
+{%- else %}
+
+def _read_cpu_flags() -> set[str]:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.partition(":")[2].split())
+    except OSError:
+        pass
+    
+    return set()
+
+
+_cpu_flags: set[str] = _read_cpu_flags()
+
+# The best build the CPU supports, running any other would die with SIGILL
+func_isa: str | None = next((
+    isa
+    for isa, required_flags in (
+        {%- for variant in variants %}
+        ("{{ variant.isa }}", {{ "{" ~ (variant.required_flags | map("repr") | join(", ")) ~ "}" if variant.required_flags else "set()" }}),
+        {%- endfor %}
+    )
+    if required_flags <= _cpu_flags
+), None)
+{% for variant in variants %}
+{{ "if" if loop.first else "elif" }} func_isa == "{{ variant.isa }}":
+    {{ variant_globals(variant) | trim | indent(4) }}
+{% endfor -%}
+else:
+    raise OSError("This CPU supports none of the packed builds ({{ variants | map(attribute="isa") | join(", ") }})")
+{%- endif %}
+
+func_buf = mmap.mmap(-1, func_size, prot=mmap.PROT_READ | mmap.PROT_WRITE)
+
+# The pieces come in stored order, each one is split over the chunks it covers
+stored_offs: int = 0
+chunks: typing.Iterator[tuple[int, int, int]] = iter(func_chunks)
+src, dest, size = next(chunks, (0, 0, 0))
+
+for piece in _func_code_pieces():
+    piece = memoryview(piece)
+    
+    while piece:
+        if stored_offs == src + size:
+            src, dest, size = next(chunks)
+        
+        piece_size: int = min(len(piece), src + size - stored_offs)
+        func_buf[dest + stored_offs - src:dest + stored_offs - src + piece_size] = piece[:piece_size]
+        piece = piece[piece_size:]
+        stored_offs += piece_size
+
+del stored_offs, chunks, src, dest, size, piece
+
+libc = ctypes.CDLL("libc.so.6", use_errno=True)
+
+# Straight from the library handles, without a ctypes function object per import.
+# The handles ctypes already has are reused, creating a CDLL costs more than resolving
+_dlsym = ctypes.pythonapi.dlsym
+_dlsym.restype = ctypes.c_void_p
+_dlsym.argtypes = (ctypes.c_void_p, ctypes.c_char_p)
+{%- if extra_libraries %}
+
+_dlopen = ctypes.pythonapi.dlopen
+_dlopen.restype = ctypes.c_void_p
+_dlopen.argtypes = (ctypes.c_char_p, ctypes.c_int)
+{%- endif %}
+
+_handles: dict[str | None, int] = {None: ctypes.pythonapi._handle, "libc.so.6": libc._handle}
+
+for lib, offs, names in func_imports:
+    if lib not in _handles:
+        _handles[lib] = _dlopen(lib.encode(), 0x2)  # RTLD_NOW
+        
+        if not _handles[lib]:
+            raise OSError(f"Can't load {lib}")
+    
+    handle: int = _handles[lib]
+    addrs: list[int | None] = [_dlsym(handle, name) for name in names]
+    
+    if None in addrs:
+        raise OSError(f"Can't find '{names[addrs.index(None)].decode()}' in {lib or 'the interpreter'}")
+    
+    # The table is contiguous, so it's patched in one go
+    struct.pack_into(f"<{len(addrs)}Q", func_buf, offs, *addrs)
+    # print(f"{lib}: {[hex(addr) for addr in addrs]}")
+    del handle, addrs
+
+func_base: int = ctypes.addressof(ctypes.c_char.from_buffer(func_buf))
+{%- if heap_size is not none %}
+
+# Pages are only backed once the allocator gets to them
+heap_buf = mmap.mmap(
+    -1, {{ heap_size }},
+    flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS | 0x4000,  # MAP_NORESERVE
+    prot=mmap.PROT_READ | mmap.PROT_WRITE,
+)
+heap_base: int = ctypes.addressof(ctypes.c_char.from_buffer(heap_buf))
+struct.pack_into("<QQ", func_buf, heap_offs, heap_base, heap_base + len(heap_buf))
+{%- endif %}
+
+libc.mprotect.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int)
+
+for start, end, prot in func_regions:
+    if start < end and libc.mprotect(func_base + start, end - start, prot) != 0:
+        raise OSError(ctypes.get_errno(), "mprotect failed")
+
+
+def _export(offs: int, restype: typing.Any, *argtypes: typing.Any) -> ctypes._CFuncPtr:
+    func_type = ctypes.CFUNCTYPE(
+        restype,
+        *argtypes,
+    )
+    return func_type(func_base + offs)
+{%- if variants[0].init_offs or variants[0].fini_offs %}
+
+
+for offs in func_inits:
+    _export(offs, None)()
 
-func_offs: int = {{ func_offs | hex_4 }}
+# atexit calls them last registered first
+for offs in reversed(func_finis):
+    atexit.register(_export(offs, None))
+
+del offs
+{%- endif %}
+{% if not fast_call and exports | selectattr("has_arrays") | list %}
+
+_FORMAT_KINDS: dict[str, str] = dict(
+    b="i", h="i", i="i", l="i", q="i", n="i",
+    B="u", H="u", I="u", L="u", Q="u", N="u",
+    f="f", d="f", e="f",
+)
 
-libc = ctypes.CDLL("libc.so.6")
 
-for name, offs in libc_relocs.items():
-    ctypes_func: ctypes._FuncPointer = getattr(libc, name)
-    ctypes_func_addr: int = ctypes.c_void_p.from_address(ctypes.addressof(ctypes_func)).value
+def as_array(obj: typing.Any, ctype: typing.Type[ctypes._SimpleCData], writable: bool = True) -> ctypes.Array:
+    '''
+    Wraps a writable C-contiguous buffer (a NumPy array, `bytearray`,
+    `memoryview`, `array.array`, ...) into a ctypes array of `ctype`
+    sharing the same memory. With `writable=False`, as for const
+    pointees, read-only buffers (`bytes`, ...) are accepted as well,
+    but ctypes can only copy those.
+    
+    Exported functions accept raw buffers too, but then these checks
+    are repeated on every call. Wrap your buffers once and pass the
+    wrapped arrays instead to skip them.
+    '''
+    
+    if isinstance(obj, ctypes.Array) and obj._type_ is ctype:
+        return obj
+    
+    view: memoryview = memoryview(obj)
+    
+    if not view.c_contiguous:
+        raise ValueError("Buffer must be C-contiguous")
     
-    func_code[offs:offs + 8] = struct.pack("<Q", ctypes_func_addr)
-    # print(f"{name} -> {ctypes_func_addr:#x}")
-    del ctypes_func, ctypes_func_addr
+    if view.readonly and writable:
+        raise TypeError("Buffer must be writable")
+    
+    fmt: str = view.format.lstrip("@=<>!")
+    if fmt != "B" and (
+        view.itemsize != ctypes.sizeof(ctype) or
+        _FORMAT_KINDS.get(fmt) != _FORMAT_KINDS.get(ctype._type_)
+    ):
+        raise TypeError(f"Buffer of format '{view.format}' doesn't match {ctype.__name__}")
+    
+    if view.nbytes % ctypes.sizeof(ctype) != 0:
+        raise ValueError(f"Buffer size isn't a multiple of {ctype.__name__} size")
+    
+    array_type: typing.Type[ctypes.Array] = ctype * (view.nbytes // ctypes.sizeof(ctype))
+    return array_type.from_buffer_copy(obj) if view.readonly else array_type.from_buffer(obj)
+{% endif %}
+
+{% if fast_call and exports %}
+
+class _PyMethodDef(ctypes.Structure):
+    _fields_ = [
+        ("ml_name", ctypes.c_char_p),
+        ("ml_meth", ctypes.c_void_p),
+        ("ml_flags", ctypes.c_int),
+        ("ml_doc", ctypes.c_char_p),
+    ]
+
+
+_METH_FASTCALL: typing.Final[int] = 0x80
 
-assert len(func_code) <= 32 * mmap.PAGESIZE, "Payload too big"
+_PyCFunction_NewEx = ctypes.pythonapi.PyCFunction_NewEx
+_PyCFunction_NewEx.restype = ctypes.py_object
+_PyCFunction_NewEx.argtypes = (ctypes.POINTER(_PyMethodDef), ctypes.c_void_p, ctypes.c_void_p)
 
-# print(func_code.hex())
+# The method definitions must outlive the builtins created from them
+_method_defs: list[_PyMethodDef] = []
 
-func_buf = mmap.mmap(-1, len(func_code), prot=mmap.PROT_READ | mmap.PROT_WRITE | mmap.PROT_EXEC)
-func_ptr = ctypes.c_void_p.from_buffer(func_buf, func_offs)
-func_type = ctypes.CFUNCTYPE(
-    None,
+
+def _export_fast(offs: int, name: str) -> typing.Callable[..., typing.Any]:
+    method_def = _PyMethodDef(name.encode(), func_base + offs, _METH_FASTCALL, None)
+    _method_defs.append(method_def)
+    
+    return _PyCFunction_NewEx(method_def, None, None)
+
+{% for export in exports %}
+{{ export.name }} = _export_fast(func_exports["{{ export.name }}"], "{{ export.name }}")
+{%- endfor %}
+
+{% else %}
+{%- for export in exports %}
+{%- if export.has_arrays %}
+_{{ export.name }} = _export(
+{%- else %}
+{{ export.name }} = _export(
+{%- endif %}
+    func_exports["{{ export.name }}"],
+    {{ export.restype_ctypes }},
+    {%- for argtype in export.argtypes %}
+    {{ argtype }},
+    {%- endfor %}
 )
-func = func_type(ctypes.addressof(func_ptr))
-func_buf.write(func_code)
+{%- if export.has_arrays %}
+
+
+def {{ export.name }}({{ export.py_params | join(", ") }}):
+    {%- for param in export.params if param.is_array %}
+    {{ param.py_name }} = as_array({{ param.py_name }}, {{ param.element_ctypes }}{{ ", writable=False" if param.is_const }})
+    {%- endfor %}
+    
+    return _{{ export.name }}({{ export.call_args | join(", ") }})
+{%- endif %}
+
+{% endfor %}
+{%- endif %}
+{%- if variants[0].func_offs is not none %}
+func = _export(func_offs, None)
 
 # breakpoint()
 
 # Magic
 func()
+{%- endif %}
 """)
 
 
-LINKER_SCRIPT: pathlib.Path = pathlib.Path(__file__).parent / "linker.ld"
+TEMPLATE_SHIM_C: typing.Final[jinja2.Template] = load_template("shim.c", """\
+#include <stdint.h>
+#include <stddef.h>
+#include <stdbool.h>
 
 
-def main():
-    args = parser.parse_args()
+#pragma region Python API
+typedef struct _object PyObject;
+typedef ptrdiff_t Py_ssize_t;
+
+typedef struct {
+    void *buf;
+    PyObject *obj;
+    Py_ssize_t len;
+    Py_ssize_t itemsize;
+    int readonly;
+    int ndim;
+    char *format;
+    Py_ssize_t *shape;
+    Py_ssize_t *strides;
+    Py_ssize_t *suboffsets;
+    void *internal;
+} Py_buffer;
+
+// PyBUF_FORMAT | PyBUF_C_CONTIGUOUS, for const pointees
+#define BUFFER_FLAGS 0x003C
+// With PyBUF_WRITABLE
+#define BUFFER_FLAGS_WRITABLE 0x003D
+
+#define PYAPI __attribute__((section(".pyapi-imp")))
+
+PYAPI PyObject **const volatile PyExc_TypeError = NULL;
+PYAPI long long (*const volatile PyLong_AsLongLong)(PyObject *obj) = NULL;
+PYAPI unsigned long long (*const volatile PyLong_AsUnsignedLongLong)(PyObject *obj) = NULL;
+PYAPI void *(*const volatile PyLong_AsVoidPtr)(PyObject *obj) = NULL;
+PYAPI double (*const volatile PyFloat_AsDouble)(PyObject *obj) = NULL;
+PYAPI int (*const volatile PyObject_IsTrue)(PyObject *obj) = NULL;
+PYAPI PyObject *(*const volatile PyLong_FromLongLong)(long long value) = NULL;
+PYAPI PyObject *(*const volatile PyLong_FromUnsignedLongLong)(unsigned long long value) = NULL;
+PYAPI PyObject *(*const volatile PyLong_FromVoidPtr)(void *value) = NULL;
+PYAPI PyObject *(*const volatile PyFloat_FromDouble)(double value) = NULL;
+PYAPI PyObject *(*const volatile PyBool_FromLong)(long value) = NULL;
+PYAPI PyObject *(*const volatile Py_BuildValue)(const char *format, ...) = NULL;
+PYAPI PyObject *(*const volatile PyErr_Occurred)(void) = NULL;
+PYAPI PyObject *(*const volatile PyErr_Format)(PyObject *exception, const char *format, ...) = NULL;
+PYAPI int (*const volatile PyObject_GetBuffer)(PyObject *obj, Py_buffer *view, int flags) = NULL;
+PYAPI void (*const volatile PyBuffer_Release)(Py_buffer *view) = NULL;
+{%- if nogil %}
+PYAPI void *(*const volatile PyEval_SaveThread)(void) = NULL;
+PYAPI void (*const volatile PyEval_RestoreThread)(void *state) = NULL;
+{%- endif %}
+
+#undef PYAPI
+#pragma endregion
+
+
+#pragma region Buffers
+// 'i', 'u' or 'f' for single integer and float formats, like `_FORMAT_KINDS` in the stub
+static inline char format_kind(const char *format) {
+    static const char formats[] = "bhilqnBHILQNfde";
+    static const char kinds[] = "iiiiiiuuuuuufff";
     
-    if not args.output:
-        args.output = args.c_source.with_suffix(".py")
-    
-    # assert args.c_source.suffix == ".c", "Only C files are supported"
-    
-    with contextlib.ExitStack() as stack:
-        source_path: pathlib.Path = args.c_source
-        object_path: pathlib.Path = args.c_source.with_suffix(".obj")
-        map_path: pathlib.Path = args.c_source.with_suffix(".map")
-        
-        stack.callback(lambda: map_path.unlink(missing_ok=True))
-        stack.callback(lambda: object_path.unlink(missing_ok=True))
-        subprocess.check_call([
-            "gcc", f"{source_path}", "-o", f"{object_path}",
-            "--std=c17", "-m64", "-finline-functions",
-            "-Wno-builtin-declaration-mismatch", "-Wall", "-Wextra", "-Wno-unknown-pragmas",
-            "-nostartfiles", "-nolibc", "-static-libgcc", "-fpie", "-ffreestanding",
-            "-march=native", "-mmemcpy-strategy=rep_8byte:-1:noalign",
-            "-T", f"{LINKER_SCRIPT}",
-            "-O3",
-            *shlex.split(args.cflags),
-            "-Xlinker", f"-Map={map_path}",
-        ])
-        
-        func_code: bytes = object_path.read_bytes()
-        mapping: dict[str, int] = process_mapping(map_path.read_text())
-        
-        libc_relocs: dict[str, int] = gather_libc_relocs(mapping)
-        
-        func_offs: int = mapping[args.entry_point]
-        
-        # subprocess.check_call(["cp", f"{object_path}", "tmp.obj"])
+    if (!format[0] || format[1]) {
+        return 0;
+    }
+    
+    for (int i = 0; formats[i]; ++i) {
+        if (formats[i] == format[0]) {
+            return kinds[i];
+        }
+    }
+    
+    return 0;
+}
+
+
+// Same check as `as_array` in the stub: raw bytes, or items of the same size and kind
+static inline bool buffer_matches(const Py_buffer *view, Py_ssize_t itemsize, char kind) {
+    // No format means unsigned bytes
+    const char *format = view->format ? view->format : "B";
+    while (*format == '@' || *format == '=' || *format == '<' || *format == '>' || *format == '!') {
+        ++format;
+    }
+    
+    if (format[0] == 'B' && !format[1]) {
+        return true;
+    }
+    
+    return view->itemsize == itemsize && format_kind(format) == kind;
+}
+#pragma endregion
 
-    with args.output.open("w") as f:
-        TEMPLATE_PY.stream(
-            compress=args.compress,
-            func_code=func_code,
-            libc_relocs=libc_relocs,
-            func_offs=func_offs,
-        ).dump(f)
 
+#pragma region Shims
+{%- for export in exports %}
+{{ export.restype }} {{ export.name }}(
+    {%- for param in export.params -%}
+    {{ param.ctype }} {{ param.name }}{{ ", " if not loop.last }}
+    {%- else -%}
+    void
+    {%- endfor -%}
+);
 
-def process_mapping(mapping_text: str) -> dict[str, int]:
-    mapping: dict[str, int] = {}
+PyObject *{{ export.shim_name }}(PyObject *self, PyObject *const *args, Py_ssize_t nargs) {
+    (void)self;
+    (void)args;
     
-    for match in re.finditer(
-        r"^\s*0x(?P<offs>[0-9a-f]+)\s+(?!\d)(?P<name>[a-zA-Z0-9_]+)(?: = \.)?\s*$",
-        mapping_text,
-        flags=re.MULTILINE,
-    ):
-        mapping[match.group("name")] = int(match.group("offs"), 16)
+    if (nargs != {{ export.py_params | length }}) {
+        PyErr_Format(*PyExc_TypeError, "{{ export.name }}() takes %d arguments (%zd given)", {{ export.py_params | length }}, nargs);
+        return NULL;
+    }
+    
+    PyObject *result = NULL;
+    bool failed = false;
+    {%- set arrays = export.params | selectattr("is_array") | list %}
+    {%- if arrays %}
+    Py_buffer views[{{ arrays | length }}];
+    int views_cnt = 0;
+    {%- endif %}
+    {%- for param in export.params %}
+    {%- set arg = "args[%d]" % export.py_params.index(param.py_name) if param.length_of is none %}
+    {%- if param.is_array %}
+    
+    if (PyObject_GetBuffer({{ arg }}, &views[views_cnt], {{ "BUFFER_FLAGS" if param.is_const else "BUFFER_FLAGS_WRITABLE" }}) != 0) {
+        goto cleanup;
+    }
+    if (!buffer_matches(&views[views_cnt++], sizeof({{ param.ctype[:-1] | trim }}), '{{ param.element_kind }}')) {
+        PyErr_Format(*PyExc_TypeError, "{{ export.name }}(): buffer of format '%s' doesn't match '{{ param.ctype[:-1] | trim }}' for '{{ param.name }}'", views[views_cnt - 1].format ? views[views_cnt - 1].format : "B");
+        goto cleanup;
+    }
+    {{ param.ctype }}{{ param.name }} = views[views_cnt - 1].buf;
+    {%- elif param.length_of is not none %}
+    {{ param.ctype }} {{ param.name }} = views[views_cnt - 1].len / sizeof(*{{ param.length_of.name }});
+    {%- elif param.fast_kind == "pointer" %}
+    {{ param.ctype }}{{ param.name }} = PyLong_AsVoidPtr({{ arg }});
+    failed |= !{{ param.name }};
+    {%- elif param.fast_kind == "float" %}
+    {{ param.ctype }} {{ param.name }} = PyFloat_AsDouble({{ arg }});
+    failed |= {{ param.name }} == -1.0;
+    {%- elif param.fast_kind == "bool" %}
+    int {{ param.name }} = PyObject_IsTrue({{ arg }});
+    failed |= {{ param.name }} == -1;
+    {%- elif param.fast_kind == "unsigned" %}
+    unsigned long long {{ param.name }} = PyLong_AsUnsignedLongLong({{ arg }});
+    failed |= {{ param.name }} == (unsigned long long)-1;
+    {%- else %}
+    long long {{ param.name }} = PyLong_AsLongLong({{ arg }});
+    failed |= {{ param.name }} == -1;
+    {%- endif %}
+    {%- endfor %}
+    
+    if (failed && PyErr_Occurred()) {
+        goto cleanup;
+    }
+    
+    {% set call -%}
+    {{ export.name }}(
+        {%- for param in export.params -%}
+        ({{ param.ctype }}){{ param.name }}{{ ", " if not loop.last }}
+        {%- endfor -%}
+    )
+    {%- endset %}
+    {%- if nogil -%}
+    // The arguments are converted and the buffers held, nothing touches Python objects until it's taken back
+    void *thread_state = PyEval_SaveThread();
+    {% endif -%}
+    {%- if export.fast_kind == "void" -%}
+    {{ call }};
+    {%- else -%}
+    {{ export.restype }} value = {{ call }};
+    {%- endif %}
+    {%- if nogil %}
+    PyEval_RestoreThread(thread_state);
+    {%- endif %}
+    
+    {% if export.fast_kind == "void" -%}
+    result = Py_BuildValue("");
+    {%- elif export.fast_kind == "pointer" -%}
+    result = PyLong_FromVoidPtr(value);
+    {%- elif export.fast_kind == "float" -%}
+    result = PyFloat_FromDouble(value);
+    {%- elif export.fast_kind == "bool" -%}
+    result = PyBool_FromLong(value);
+    {%- elif export.fast_kind == "unsigned" -%}
+    result = PyLong_FromUnsignedLongLong(value);
+    {%- else -%}
+    result = PyLong_FromLongLong(value);
+    {%- endif %}
     
-    return mapping
+cleanup:
+    {%- if arrays %}
+    while (views_cnt > 0) {
+        PyBuffer_Release(&views[--views_cnt]);
+    }
+    {%- endif %}
+    return result;
+}
+
+{% endfor %}
+#pragma endregion
+""")
+
+
+TEMPLATE_PGO_DRIVER_C: typing.Final[jinja2.Template] = load_template("pgo_driver.c", """\
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <stdio.h>
+#include <stdlib.h>
+{%- if heap_size is not none %}
+#include <sys/mman.h>
+{%- endif %}
+
+
+// The imports of the instrumented object, renamed and made writable by objcopy
+{%- for name in imports %}
+extern void *volatile __pack_imp_{{ name }};
+{%- endfor %}
+{%- if heap_size is not none %}
+
+extern struct {
+    char *cur;
+    char *end;
+} __pack_heap;
+{%- endif %}
+
+void {{ entry_point }}(void);
+
+
+// Before the object's own static constructors, which may already call the imports
+__attribute__((constructor(101))) static void resolve_imports(void) {
+    {%- for name in imports %}
+    if (!(__pack_imp_{{ name }} = dlsym(RTLD_DEFAULT, "{{ name }}"))) {
+        fprintf(stderr, "Can't resolve '{{ name }}'\\n");
+        exit(1);
+    }
+    {%- endfor %}
+    {%- if heap_size is not none %}
+    
+    __pack_heap.cur = mmap(NULL, {{ heap_size }}, PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_ANONYMOUS | MAP_NORESERVE, -1, 0);
+    if (__pack_heap.cur == MAP_FAILED) {
+        perror("mmap");
+        exit(1);
+    }
+    __pack_heap.end = __pack_heap.cur + {{ heap_size }};
+    {%- endif %}
+}
 
 
-def gather_libc_relocs(mapping: dict[str, int]) -> dict[str, int]:
-    libc_relocs: dict[str, int] = {}
-    collect: bool = False
+int main(void) {
+    {{ entry_point }}();
     
-    for name, offs in mapping.items():
-        if name == "__libc_imp_start":
-            collect = True
+    // The profile is written by an atexit handler
+    exit(0);
+}
+""")
+
+
+TEMPLATE_EXEC_PY: typing.Final[jinja2.Template] = load_template("exec.py", """\
+from __future__ import annotations
+import typing
+import sys
+import os
+{%- for module in payload.modules %}
+import {{ module }}
+{%- endfor %}
+
+
+func_code: bytes = {{ payload.literal }}
+
+
+{{ payload.pieces_source }}
+
+def _write_executable(fd: int) -> None:
+    for piece in _func_code_pieces():
+        piece = memoryview(piece)
+        while piece:
+            piece = piece[os.write(fd, piece):]
+
+
+try:
+    _fd: int = os.memfd_create("{{ name }}", os.MFD_CLOEXEC)
+    _write_executable(_fd)
+    # Replaces the interpreter, so stdin, stdout and the exit status are the program's own
+    os.execve(_fd, sys.argv, os.environ)
+except (AttributeError, OSError):
+    pass
+
+# No memfd (an old kernel or Python, or a sandbox forbids it), so the program runs from a
+# temporary file as a child instead, which can be removed once it exits. /tmp is often
+# mounted noexec, so the other places are tried until one lets it run
+import subprocess
+import tempfile
+
+_status: int | None = None
+_errors: list[str] = []
+
+for _parent in dict.fromkeys(filter(None, (
+    tempfile.gettempdir(),
+    os.environ.get("XDG_RUNTIME_DIR"),
+    os.path.dirname(os.path.abspath(__file__)),
+    os.getcwd(),
+))):
+    try:
+        with tempfile.TemporaryDirectory(dir=_parent) as _dir:
+            _path: str = os.path.join(_dir, "{{ name }}")
+            _fd = os.open(_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o700)
+            try:
+                _write_executable(_fd)
+            finally:
+                os.close(_fd)
+            
+            _status = subprocess.call([_path, *sys.argv[1:]])
+    except OSError as _error:
+        # Only failures to start it, the program must not run twice
+        if _status is None:
+            _errors.append(f"  {_parent}: {_error}")
             continue
-        if name == "__libc_imp_end":
-            collect = False
-            break
+    
+    break
+else:
+    print(
+        "{{ name }}: can't run the packed executable, memfd is unavailable and no directory allows executing files:",
+        *_errors,
+        sep="\\n",
+        file=sys.stderr,
+    )
+    # What shells report for a command that can't be executed
+    sys.exit(126)
+
+# Killed by a signal, reported the way shells do
+sys.exit(_status if _status >= 0 else 128 - _status)
+""")
+
+
+STUB_NAMES: typing.Final[frozenset[str]] = frozenset({
+    "typing", "sys", "ctypes", "struct", "mmap", "zlib", "lzma", "bz2", "base64",
+    "func_code", "func_imports", "libc", "func_buf", "func_base", "func_offs", "func", "as_array",
+    "heap_buf", "heap_base", "heap_offs", "func_regions", "func_size", "func_chunks", "func_exports", "func_isa",
+    "atexit", "func_inits", "func_finis",
+    "_dlsym", "_dlopen", "_handles", "_read_cpu_flags", "_cpu_flags", "_func_code_pieces", "_export", "_FORMAT_KINDS",
+    "_PyMethodDef", "_METH_FASTCALL", "_PyCFunction_NewEx", "_method_defs", "_export_fast",
+})
+
+
+LINKER_SCRIPT: pathlib.Path = pathlib.Path(__file__).parent / "linker.ld"
+RUNTIME_DIR: pathlib.Path = pathlib.Path(__file__).parent / "runtime"
+
+
+@dataclasses.dataclass(frozen=True)
+class PackJob:
+    source: pathlib.Path
+    output: pathlib.Path
+    cflags: str = ""
+
+
+# Languages by the source suffix, anything else is built as C
+SOURCE_LANGUAGES: typing.Final[dict[str, str]] = {
+    ".cpp": "c++",
+    ".cc": "c++",
+    ".cxx": "c++",
+}
+
+# There is no C++ runtime in the payload to throw exceptions or look up types with,
+# and static locals are initialized without guards
+LANGUAGE_FLAGS: typing.Final[dict[str, list[str]]] = {
+    "c": ["--std=c17", "-Wno-builtin-declaration-mismatch"],
+    "c++": ["--std=c++17", "-fno-exceptions", "-fno-rtti", "-fno-threadsafe-statics"],
+}
+
+
+def source_language(source: pathlib.Path) -> str:
+    return SOURCE_LANGUAGES.get(source.suffix, "c")
+
+
+def build_gcc_flags(
+    args: argparse.Namespace,
+    job: PackJob,
+    isa: str = "native",
+    language: str | None = None,
+) -> list[str]:
+    """
+    The language defaults to the source's, the generated shims and the final link
+    are always C
+    """
+    
+    return [
+        *LANGUAGE_FLAGS[language or source_language(job.source)],
+        "-m64", "-finline-functions",
+        "-Wall", "-Wextra", "-Wno-unknown-pragmas",
+        "-nostartfiles", "-nolibc", "-static-libgcc", "-fpie", "-ffreestanding",
+        f"-march={isa}", "-mmemcpy-strategy=rep_8byte:-1:noalign",
+        "-T", f"{LINKER_SCRIPT}",
+        "-I", f"{RUNTIME_DIR}",
+        "-O3",
+        *(["-DPACK_HEAP"] if args.heap_size is not None else []),
+        *shlex.split(args.cflags),
+        *shlex.split(job.cflags),
+    ]
+
+
+# Compilers for --exec-mode by the source language
+EXEC_COMPILERS: typing.Final[dict[str, str]] = {
+    "c": "gcc",
+    "c++": "g++",
+}
+
+
+def build_exec_flags(args: argparse.Namespace, job: PackJob, isa: str = "native") -> list[str]:
+    return [
+        "-m64", "-static", "-s",
+        f"-march={isa}",
+        "-O3",
+        *shlex.split(args.cflags),
+        *shlex.split(job.cflags),
+    ]
+
+
+def gather_jobs(args: argparse.Namespace) -> list[PackJob]:
+    sources: list[pathlib.Path] = []
+    
+    for pattern in args.c_source:
+        # Quoted patterns reach us unexpanded, plain paths are kept even if they don't exist yet
+        matches: list[str] = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            raise ValueError(f"No sources match '{pattern}'")
         
-        if collect:
-            libc_relocs[name] = offs
+        sources.extend(map(pathlib.Path, matches))
+    
+    sources = list(dict.fromkeys(sources))
+    
+    if not args.isa:
+        args.isa = ["native"]
+    elif "native" in args.isa and len(args.isa) > 1:
+        raise ValueError("--isa native can't be combined with other levels, the stub couldn't tell if it runs")
+    
+    if args.exec_mode:
+        conflicting: list[str] = [
+            flag
+            for flag, given in (
+                ("-x", bool(args.export)),
+                ("--fast-call", args.fast_call),
+                ("--heap-size", args.heap_size is not None),
+                ("--pgo", args.pgo is not None),
+                ("several --isa", len(args.isa) > 1),
+            )
+            if given
+        ]
+        if conflicting:
+            raise ValueError(f"--exec-mode packs a whole executable, it can't be combined with {', '.join(conflicting)}")
+    
+    # Best first, the stub takes the first one the CPU supports
+    args.isa = sorted(set(args.isa), key=list(ISA_LEVEL_FLAGS).index, reverse=True) if len(args.isa) > 1 else args.isa
+    
+    variants: list[tuple[str, str]] = [("", "")]
+    for variant in args.variant:
+        name, sep, cflags = variant.partition("=")
+        if not sep or not name:
+            raise ValueError(f"Expected '--variant NAME=CFLAGS', got '{variant}'")
+        
+        variants.append((f".{name}", cflags))
+    
+    if args.output and (len(sources) > 1 or len(variants) > 1):
+        if args.output.exists() and not args.output.is_dir():
+            raise ValueError("-o must be a directory when packing several sources or variants")
+        
+        args.output.mkdir(parents=True, exist_ok=True)
+    
+    jobs: list[PackJob] = []
+    
+    for source in sources:
+        for suffix, cflags in variants:
+            output: pathlib.Path
+            if args.output and args.output.is_dir():
+                output = args.output / f"{source.stem}{suffix}.py"
+            elif args.output:
+                output = args.output
+            else:
+                output = source.with_name(f"{source.stem}{suffix}.py")
+            
+            jobs.append(PackJob(source, output, cflags))
+    
+    # Concurrent jobs would overwrite each other's output, e.g. 'a/s.c b/s.c -o out'
+    sources_by_output: dict[pathlib.Path, list[pathlib.Path]] = {}
+    for job in jobs:
+        sources_by_output.setdefault(job.output.resolve(), []).append(job.source)
+    
+    for output, output_sources in sources_by_output.items():
+        if len(output_sources) > 1:
+            raise ValueError(f"{', '.join(map(str, output_sources))} would be packed to the same {output}, rename them or pack them separately")
+    
+    return jobs
+
+
+def run_job(args: argparse.Namespace, job: PackJob) -> tuple[bool, str]:
+    """
+    Packs one job and returns whether it succeeded along with everything it printed,
+    so the output of concurrent jobs doesn't interleave
+    """
+    
+    log = io.StringIO()
+    
+    try:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            pack(args, job)
+    except subprocess.CalledProcessError as e:
+        print(f"{pathlib.Path(e.cmd[0]).name} exited with code {e.returncode}", file=log)
+        return False, log.getvalue()
+    except (OSError, ValueError) as e:
+        print(f"{type(e).__name__}: {e}", file=log)
+        return False, log.getvalue()
+    except Exception:
+        # Anything else is a bug in the packer, but it shouldn't take the other jobs down
+        print(traceback.format_exc(), end="", file=log)
+        return False, log.getvalue()
+    
+    return True, log.getvalue()
+
+
+def run_jobs(args: argparse.Namespace, jobs: typing.Sequence[PackJob]) -> int:
+    """
+    Returns the number of failed jobs
+    """
+    
+    failed: int = 0
+    
+    def report(job: PackJob, ok: bool, log: str) -> None:
+        nonlocal failed
+        
+        failed += not ok
+        status: str = f"{job.source} -> {job.output}" + ("" if ok else ": FAILED")
+        print(status + ("\n" + log.rstrip() if log.strip() else ""), flush=True)
+    
+    if len(jobs) == 1 or args.jobs == 1:
+        for job in jobs:
+            report(job, *run_job(args, job))
+        
+        return failed
+    
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures: dict[concurrent.futures.Future, PackJob] = {
+            pool.submit(run_job, args, job): job
+            for job in jobs
+        }
+        
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result: tuple[bool, str] = future.result()
+            except Exception as e:
+                # The worker died, or the job couldn't be sent to it
+                result = False, f"{type(e).__name__}: {e}"
+            
+            report(futures[future], *result)
+    
+    return failed
+
+
+def gather_dependencies(args: argparse.Namespace, job: PackJob) -> list[pathlib.Path]:
+    """
+    The source and every header it includes, as reported by 'gcc -M'
+    """
+    
+    command: list[str] = (
+        [EXEC_COMPILERS[source_language(job.source)], *build_exec_flags(args, job)]
+        if args.exec_mode else
+        ["gcc", *build_gcc_flags(args, job)]
+    )
+    
+    result = subprocess.run(
+        [*command, "-M", "-MT", "pack", f"{job.source}"],
+        capture_output=True,
+        text=True,
+    )
+    
+    if result.returncode != 0:
+        return [job.source]
+    
+    return [pathlib.Path(path) for path in result.stdout.replace("\\\n", " ").split()[1:]]
+
+
+def snapshot_mtimes(paths: typing.Iterable[pathlib.Path]) -> dict[pathlib.Path, int | None]:
+    mtimes: dict[pathlib.Path, int | None] = {}
+    
+    for path in paths:
+        try:
+            mtimes[path] = path.stat().st_mtime_ns
+        except OSError:
+            mtimes[path] = None
+    
+    return mtimes
+
+
+def watch(args: argparse.Namespace, jobs: typing.Sequence[PackJob]) -> None:
+    """
+    Polls the sources and their headers, re-packing only the jobs whose inputs changed.
+    Unchanged preprocessed code (e.g. after editing a comment) is served from the build cache
+    """
+    
+    snapshots: dict[PackJob, dict[pathlib.Path, int | None]] = {}
+    
+    while True:
+        changed: list[PackJob] = [
+            job for job in jobs
+            if job not in snapshots or snapshot_mtimes(snapshots[job]) != snapshots[job]
+        ]
+        
+        if changed:
+            # Taken before packing, so edits made during the build trigger another one
+            for job in changed:
+                snapshots[job] = snapshot_mtimes(gather_dependencies(args, job))
+            
+            run_jobs(args, changed)
+            print(f"Watching {len(jobs)} source(s) for changes, press Ctrl+C to stop", flush=True)
+        
+        time.sleep(WATCH_INTERVAL)
+
+
+WATCH_INTERVAL: typing.Final[float] = 0.5
+
+
+def main():
+    args = parser.parse_args()
+    
+    try:
+        jobs: list[PackJob] = gather_jobs(args)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    if args.watch:
+        try:
+            watch(args, jobs)
+        except KeyboardInterrupt:
+            pass
+        
+        return 0
+    
+    return 1 if run_jobs(args, jobs) else 0
+
+
+def pack(args: argparse.Namespace, job: PackJob) -> None:
+    # assert job.source.suffix == ".c", "Only C files are supported"
+    
+    if args.exec_mode:
+        pack_executable(args, job)
+        return
+    
+    # Intermediate files never land next to the sources, whatever happens to the build
+    with tempfile.TemporaryDirectory(prefix="pack_c-") as build_dir:
+        source_path: pathlib.Path = job.source
+        shim_path: pathlib.Path = pathlib.Path(build_dir) / source_path.with_suffix(".shim.c").name
+        
+        exports: list[Export] = gather_exports(source_path.read_text(), args.export)
+        export_names: set[str] = {export.name for export in exports}
+        for export in exports:
+            if keyword.iskeyword(export.name):
+                raise ValueError(f"Exported function '{export.name}' is a Python keyword, so the stub can't define it")
+            if export.name in STUB_NAMES:
+                raise ValueError(f"Exported function '{export.name}' would shadow a name used by the generated stub")
+            # Functions taking arrays go through ctypes as `_<name>`, wrapped by a Python function
+            if not args.fast_call and export.has_arrays and ("_" + export.name in STUB_NAMES | export_names):
+                raise ValueError(f"Exported function '{export.name}' needs the name '_{export.name}' in the generated stub, which is taken")
+        
+        extra_sources: list[pathlib.Path] = []
+        if args.fast_call and exports:
+            TEMPLATE_SHIM_C.stream(exports=exports, nogil=args.nogil).dump(str(shim_path))
+            extra_sources.append(shim_path)
+        
+        profile: typing.Callable[[], pathlib.Path] | None = None
+        if args.pgo is not None:
+            if not args.entry_point:
+                raise ValueError("--pgo runs the entry point on the training input, it can't be empty")
+            
+            # Trained once, and only if some variant isn't in the build cache yet
+            profile = functools.cache(functools.partial(train_profile, args, job, pathlib.Path(build_dir)))
+        
+        variants: list[Variant] = [
+            build_variant(args, job, isa, pathlib.Path(build_dir), exports, extra_sources, profile)
+            for isa in args.isa
+        ]
+    
+    with job.output.open("w") as f:
+        TEMPLATE_PY.stream(
+            variants=variants,
+            modules=sorted({module for variant in variants for module in variant.payload.modules}),
+            # Libraries the stub has to load itself
+            extra_libraries=any(
+                table.library not in (None, "libc.so.6")
+                for variant in variants
+                for table in variant.imports
+            ),
+            heap_size=args.heap_size,
+            exports=exports,
+            fast_call=args.fast_call,
+        ).dump(f)
+
+
+def pack_executable(args: argparse.Namespace, job: PackJob) -> None:
+    """
+    Packs the source built as a regular static executable, which keeps the whole of libc
+    (and libstdc++) and starts from its own main(). It's stored whole, the symbols are
+    not needed
+    """
+    
+    compiler: str = EXEC_COMPILERS[source_language(job.source)]
+    flags: list[str] = build_exec_flags(args, job, args.isa[0])
+    
+    executable: bytes
+    
+    cache_key: str | None = None
+    cached: tuple[bytes, dict[str, Symbol]] | None = None
+    if not args.no_cache:
+        cache_key = build_cache_key([job.source], flags, compiler=compiler)
+        cached = cache_load(cache_key)
+    
+    if cached is not None:
+        executable, _ = cached
+    else:
+        with tempfile.TemporaryDirectory(prefix="pack_c-") as build_dir:
+            executable_path: pathlib.Path = pathlib.Path(build_dir) / job.source.stem
+            run_gcc([compiler, f"{job.source}", "-o", f"{executable_path}", *flags])
+            executable = executable_path.read_bytes()
+        
+        if cache_key is not None:
+            cache_store(cache_key, executable, {}, args.cache_size)
+    
+    payload: EncodedPayload
+    if args.auto:
+        payload = pick_encoding(executable, args.auto)
+    else:
+        payload = encode_payload(executable, args.encoding, args.codec)
+    
+    with job.output.open("w") as f:
+        TEMPLATE_EXEC_PY.stream(
+            payload=payload,
+            name=job.source.stem,
+        ).dump(f)
+
+
+def build_variant(
+    args: argparse.Namespace,
+    job: PackJob,
+    isa: str,
+    build_dir: pathlib.Path,
+    exports: typing.Sequence[Export],
+    extra_sources: typing.Sequence[pathlib.Path],
+    profile: typing.Callable[[], pathlib.Path] | None = None,
+) -> Variant:
+    source_path: pathlib.Path = job.source
+    elf_path: pathlib.Path = build_dir / f"{source_path.stem}.{isa}.elf"
+    
+    gcc_flags: list[str] = build_gcc_flags(args, job, isa)
+    
+    func_code: bytes
+    symbols: dict[str, Symbol]
+    
+    cache_key: str | None = None
+    cached: tuple[bytes, dict[str, Symbol]] | None = None
+    if not args.no_cache:
+        # The profile is known to come from the entry point run on the training input,
+        # so the key doesn't need it, and a hit skips the training run
+        cache_key = build_cache_key(
+            [source_path, *extra_sources],
+            gcc_flags,
+            [args.pgo] if profile is not None else [],
+            extra_text=f"pgo {args.entry_point} {args.heap_size}" if profile is not None else "",
+        )
+        cached = cache_load(cache_key)
+    
+    if cached is not None:
+        func_code, symbols = cached
+    else:
+        sources: list[pathlib.Path] = [source_path, *extra_sources]
+        
+        if profile is not None:
+            profile_dir: pathlib.Path = profile()
+            
+            # Compiled on its own to the same path as the instrumented object, gcc looks up the profile by it
+            sources[0] = build_dir / PGO_OBJECT_NAME
+            run_gcc([
+                "gcc", "-c", f"{source_path}", "-o", f"{sources[0]}",
+                *gcc_flags,
+                f"-fprofile-use={profile_dir}",
+                # Code the training input didn't reach is still optimized for speed
+                "-fprofile-partial-training",
+                # Profiles are collected with -march=native, other levels may differ slightly
+                "-Wno-error=coverage-mismatch",
+            ])
+        elif source_language(source_path) != "c":
+            # Compiled on its own, the shims and the link are C
+            sources[0] = build_dir / f"{source_path.stem}.{isa}.o"
+            run_gcc(["gcc", "-c", f"{source_path}", "-o", f"{sources[0]}", *gcc_flags])
+        
+        run_gcc([
+            "gcc", *map(str, sources), "-o", f"{elf_path}",
+            *build_gcc_flags(args, job, isa, "c"),
+            # Linked at 0 as a plain executable, so there is nothing left to relocate
+            "-no-pie", "-Wl,--build-id=none",
+        ])
+        
+        func_code, symbols = read_elf(elf_path.read_bytes())
+        
+        if cache_key is not None:
+            cache_store(cache_key, func_code, symbols, args.cache_size)
+    
+    # C++ mangles the names of anything not declared extern "C"
+    linkage_hint: str = ' or not extern "C"' if source_language(source_path) == "c++" else ""
+    
+    if args.entry_point and not is_function(symbols, args.entry_point):
+        raise ValueError(f"Entry point '{args.entry_point}' is missing from the linked payload (is it static{linkage_hint}?), pass -e '' to only export functions")
+    
+    heap_offs: int | None = None
+    if args.heap_size is not None:
+        if "__pack_heap" not in symbols:
+            raise ValueError("--heap-size needs the allocator from 'pack/alloc.h'")
+        if symbols["__pack_heap"].size != 16:
+            raise ValueError(f"'__pack_heap' is {symbols['__pack_heap'].size} bytes, the stub writes two pointers to it")
+        
+        heap_offs = symbols["__pack_heap"].offs
+    
+    export_offs: dict[str, int] = {}
+    for export in exports:
+        if not is_function(symbols, export.name):
+            raise ValueError(f"Exported function '{export.name}' is missing from the linked payload, is it static{linkage_hint}?")
+        
+        # The stub wraps the shim instead of the function itself in the fast-call mode
+        export_offs[export.name] = symbols[export.shim_name if args.fast_call else export.name].offs
+    
+    # subprocess.check_call(["cp", f"{elf_path}", "tmp.elf"])
+    
+    rodata_offs: int = symbols["__rodata_start"].offs
+    data_offs: int = symbols["__data_start"].offs
+    
+    stored_code: bytes
+    func_chunks: list[tuple[int, int, int]]
+    stored_code, func_chunks = compact_regions(func_code, (0, rodata_offs, data_offs))
+    
+    payload: EncodedPayload
+    if args.auto:
+        payload = pick_encoding(stored_code, args.auto)
+    else:
+        payload = encode_payload(stored_code, args.encoding, args.codec)
+    
+    return Variant(
+        isa=isa,
+        payload=payload,
+        func_chunks=func_chunks,
+        func_size=max(symbols["__bss_end"].offs, len(func_code)),
+        rodata_offs=rodata_offs,
+        data_offs=data_offs,
+        imports=[
+            table
+            for section, library in IMPORT_SECTIONS.items()
+            if (table := gather_imports(symbols, section, library)) is not None
+        ],
+        func_offs=symbols[args.entry_point].offs if args.entry_point else None,
+        heap_offs=heap_offs,
+        export_offs=export_offs,
+        init_offs=read_offsets(func_code, symbols["start_ctors"].offs, symbols["end_ctors"].offs),
+        # .fini_array runs back to front
+        fini_offs=read_offsets(func_code, symbols["start_dtors"].offs, symbols["end_dtors"].offs)[::-1],
+    )
+
+
+def read_offsets(func_code: bytes, start: int, end: int) -> list[int]:
+    """
+    A table of function pointers, like .init_array. The image is linked at 0, so they
+    are already offsets into the mapping
+    """
+    
+    # Empty tables may point past the image, which ends with the last section that has bytes
+    if end <= start:
+        return []
+    
+    return list(struct.unpack_from(f"<{(end - start) // 8}Q", func_code, start))
+
+
+def run_gcc(command: typing.Sequence[str]) -> None:
+    # Diagnostics go through sys.stderr, which a batch job captures
+    result = subprocess.run(command, capture_output=True, text=True)
+    sys.stderr.write(result.stderr)
+    result.check_returncode()
+
+
+PGO_OBJECT_NAME: typing.Final[str] = "pgo.o"
+
+
+def train_profile(args: argparse.Namespace, job: PackJob, build_dir: pathlib.Path) -> pathlib.Path:
+    """
+    Builds the source as a hosted instrumented executable, runs the entry point on the
+    training input and returns the directory with the collected profile.
+    
+    The payload has no gcov runtime, so the object is linked with libc instead. Its
+    imports would clash with the libc functions they are named after, so objcopy renames
+    them and makes their section writable, and a generated driver fills them in.
+    """
+    
+    profile_dir: pathlib.Path = build_dir / "profile"
+    object_path: pathlib.Path = build_dir / PGO_OBJECT_NAME
+    driver_path: pathlib.Path = build_dir / "pgo_driver.c"
+    executable_path: pathlib.Path = build_dir / "pgo"
+    
+    run_gcc([
+        "gcc", "-c", f"{job.source}", "-o", f"{object_path}",
+        *build_gcc_flags(args, job),
+        f"-fprofile-generate={profile_dir}",
+    ])
+    
+    # The interpreter's own imports only come from the fast-call shims, which aren't built here
+    sections: list[str] = [section for section, library in IMPORT_SECTIONS.items() if library is not None]
+    
+    # Symbol names, which are mangled in C++, mapped to the library functions
+    imports: dict[str, str] = {
+        line.split()[-1]: import_name(line.split()[-1])
+        for line in subprocess.run(
+            ["objdump", "-t", f"{object_path}"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.splitlines()
+        if set(sections) & set(line.split()[-3:-2])
+    }
+    
+    subprocess.run([
+        "objcopy",
+        *(arg for section in sections for arg in ("--set-section-flags", f"{section}=alloc,load,contents,data")),
+        *(f"--redefine-sym={symbol}=__pack_imp_{name}" for symbol, name in imports.items()),
+        f"{object_path}",
+    ], check=True)
+    
+    TEMPLATE_PGO_DRIVER_C.stream(
+        imports=list(imports.values()),
+        heap_size=args.heap_size,
+        entry_point=args.entry_point,
+    ).dump(str(driver_path))
+    
+    run_gcc([
+        "gcc", f"{object_path}", f"{driver_path}", "-o", f"{executable_path}",
+        "-lgcov", "-ldl", "-Wl,--no-as-needed", "-lm", "-lpthread",
+    ])
+    
+    with args.pgo.open("rb") as training_input:
+        subprocess.run([f"{executable_path}"], stdin=training_input, stdout=subprocess.DEVNULL, check=True)
+    
+    return profile_dir
+
+
+# The CPU flags (as named in /proc/cpuinfo) each x86-64 microarchitecture level adds
+ISA_LEVEL_FLAGS: typing.Final[dict[str, tuple[str, ...]]] = {
+    "x86-64": (),
+    "x86-64-v2": ("cx16", "lahf_lm", "popcnt", "pni", "sse4_1", "sse4_2", "ssse3"),
+    "x86-64-v3": ("abm", "avx", "avx2", "bmi1", "bmi2", "f16c", "fma", "movbe", "xsave"),
+    "x86-64-v4": ("avx512bw", "avx512cd", "avx512dq", "avx512f", "avx512vl"),
+}
+
+
+@dataclasses.dataclass
+class Variant:
+    isa: str
+    payload: EncodedPayload
+    func_chunks: list[tuple[int, int, int]]
+    func_size: int
+    rodata_offs: int
+    data_offs: int
+    imports: list[ImportTable]
+    func_offs: int | None
+    heap_offs: int | None
+    export_offs: dict[str, int]
+    init_offs: list[int]
+    fini_offs: list[int]
+    
+    @property
+    def required_flags(self) -> list[str]:
+        """
+        Every level includes the ones below it
+        """
+        
+        levels: list[str] = list(ISA_LEVEL_FLAGS)
+        return [
+            flag
+            for level in levels[:levels.index(self.isa) + 1]
+            for flag in ISA_LEVEL_FLAGS[level]
+        ]
+
+
+# encode, decode, and how many characters to decode at once (a whole number of groups)
+ENCODINGS: typing.Final[dict[str, tuple[typing.Callable[[bytes], bytes], str | None, int]]] = {
+    "repr": (lambda data: data, None, 0x10000),
+    "b85": (base64.b85encode, "base64.b85decode", 0xffff),
+    "b64": (base64.b64encode, "base64.b64decode", 0x10000),
+}
+
+# compress, and the streaming decompressor
+CODECS: typing.Final[dict[str, tuple[typing.Callable[[bytes], bytes], str | None]]] = {
+    "none": (lambda data: data, None),
+    "zlib": (functools.partial(zlib.compress, level=9), "zlib.decompressobj"),
+    "lzma": (functools.partial(lzma.compress, preset=9 | lzma.PRESET_EXTREME), "lzma.LZMADecompressor"),
+    "bz2": (functools.partial(bz2.compress, compresslevel=9), "bz2.BZ2Decompressor"),
+}
+
+
+@dataclasses.dataclass
+class EncodedPayload:
+    encoding: str
+    codec: str
+    literal: str
+    
+    @property
+    def modules(self) -> list[str]:
+        return sorted({
+            func.split(".")[0]
+            for func in (ENCODINGS[self.encoding][1], CODECS[self.codec][1])
+            if func is not None
+        })
+    
+    @property
+    def pieces_source(self) -> str:
+        """
+        A generator over the function code, decoded and decompressed a bounded piece at a
+        time, so the stub writes it straight into the mapping without a full-size copy
+        """
+        
+        _, decode, step = ENCODINGS[self.encoding]
+        _, decompressor = CODECS[self.codec]
+        
+        piece: str = "piece" if decode is None else f"{decode}(piece)"
+        
+        lines: list[str] = ["def _func_code_pieces() -> typing.Iterator[bytes | memoryview]:"]
+        if decompressor is not None:
+            lines += [f"    decompressor = {decompressor}()", "    "]
+        lines += [
+            f"    for start in range(0, len(func_code), {step:#x}):",
+            f"        piece = memoryview(func_code)[start:start + {step:#x}]",
+            f"        yield {piece if decompressor is None else f'decompressor.decompress({piece})'}",
+        ]
+        if self.codec == "zlib":
+            lines += ["    ", "    yield decompressor.flush()"]
+        
+        return "\n".join(lines) + "\n"
+    
+    @property
+    def source(self) -> str:
+        return (
+            "import typing\n" +
+            "".join(f"import {module}\n" for module in self.modules) +
+            f"func_code = {self.literal}\n" +
+            self.pieces_source
+        )
+    
+    def measure_load_time(self, repeat: int = 3) -> float:
+        """
+        Best time to tokenize, compile and run the source that produces the function code.
+        Measured in a fresh interpreter each time, so the decoders' imports are counted too
+        """
+        
+        best: float = float("inf")
+        
+        for _ in range(repeat):
+            best = min(best, float(subprocess.run(
+                [sys.executable, "-c", MEASURE_LOAD_PY],
+                input=self.source,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout))
+        
+        return best
+
+
+MEASURE_LOAD_PY: typing.Final[str] = """\
+import sys, time
+source = sys.stdin.read()
+start = time.perf_counter()
+namespace = {}
+exec(compile(source, "<payload>", "exec"), namespace)
+for piece in namespace["_func_code_pieces"]():
+    pass
+print(time.perf_counter() - start)
+"""
+
+
+def encode_payload(func_code: bytes, encoding: str, codec: str) -> EncodedPayload:
+    compress, _ = CODECS[codec]
+    encode, _, _ = ENCODINGS[encoding]
+    
+    return EncodedPayload(encoding, codec, repr(encode(compress(func_code))))
+
+
+def pick_encoding(func_code: bytes, objective: str) -> EncodedPayload:
+    results: list[tuple[EncodedPayload, int, float]] = []
+    
+    for encoding, codec in itertools.product(ENCODINGS, CODECS):
+        payload: EncodedPayload = encode_payload(func_code, encoding, codec)
+        results.append((payload, len(payload.source.encode()), payload.measure_load_time()))
+    
+    best: tuple[EncodedPayload, int, float] = min(
+        results,
+        key=lambda result: result[1] if objective == "size" else result[2],
+    )
+    
+    print(f"{'encoding':<10}{'codec':<8}{'size, B':>12}{'load, ms':>12}")
+    for payload, size, load_time in results:
+        mark: str = "  <-" if payload is best[0] else ""
+        print(f"{payload.encoding:<10}{payload.codec:<8}{size:>12}{load_time * 1e3:>12.3f}{mark}")
+    
+    return best[0]
+
+
+def compact_regions(func_code: bytes, region_starts: typing.Sequence[int]) -> tuple[bytes, list[tuple[int, int, int]]]:
+    """
+    Drops the trailing zeros of every region, which include the alignment padding
+    before the next one. Returns the remaining bytes and the (src, dest, size) chunks
+    to copy them back with.
+    """
+    
+    stored_code: bytearray = bytearray()
+    chunks: list[tuple[int, int, int]] = []
+    
+    for start, end in itertools.pairwise([*region_starts, len(func_code)]):
+        region: bytes = func_code[start:end].rstrip(b"\x00")
+        
+        if region:
+            chunks.append((len(stored_code), start, len(region)))
+            stored_code += region
+    
+    return bytes(stored_code), chunks
+
+
+# Bump when the cached build (the payload layout or the symbol table) changes meaning
+CACHE_VERSION: typing.Final[int] = 2
+
+
+def build_cache_key(
+    sources: typing.Sequence[pathlib.Path],
+    gcc_flags: typing.Sequence[str],
+    extra_inputs: typing.Sequence[pathlib.Path] = (),
+    compiler: str = "gcc",
+    extra_text: str = "",
+) -> str:
+    """
+    Hashes everything the build depends on: the preprocessed sources (so edits to included
+    headers count, but not where the sources are), the gcc version and the flags as gcc expands them (so '-march=native'
+    means this CPU), and the linker script
+    """
+    
+    key = hashlib.sha256(f"pack_c cache v{CACHE_VERSION}\n".encode())
+    
+    # Only the driver output is needed, the compiler itself isn't run with '-###'
+    key.update(subprocess.run(
+        [compiler, "-###", "-E", *gcc_flags, "-x", "c", os.devnull],
+        capture_output=True,
+        check=True,
+    ).stderr)
+    key.update(subprocess.run(
+        [compiler, "-E", "-P", *gcc_flags, *map(str, sources)],
+        capture_output=True,
+        check=True,
+    ).stdout)
+    key.update(LINKER_SCRIPT.read_bytes())
+    
+    # E.g. the training input, which may be passed by a path that changes between builds
+    for path in extra_inputs:
+        key.update(path.read_bytes())
+    key.update(extra_text.encode())
+    
+    return key.hexdigest()
+
+
+def cache_load(key: str) -> tuple[bytes, dict[str, Symbol]] | None:
+    entry_path: pathlib.Path = BUILD_CACHE_DIR / key
+    
+    try:
+        func_code: bytes = (entry_path / "code.bin").read_bytes()
+        symbols: dict[str, Symbol] = {
+            name: Symbol(*fields)
+            for name, fields in json.loads((entry_path / "symbols.json").read_text()).items()
+        }
+    except (OSError, ValueError, TypeError):
+        return None
+    
+    # The modification time orders the entries for eviction
+    entry_path.touch()
+    
+    return func_code, symbols
+
+
+def cache_store(key: str, func_code: bytes, symbols: dict[str, Symbol], max_size: int) -> None:
+    BUILD_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    
+    # Written aside and renamed into place, so a concurrent pack never sees a partial entry
+    staging_path: pathlib.Path = pathlib.Path(tempfile.mkdtemp(prefix=".staging-", dir=BUILD_CACHE_DIR))
+    (staging_path / "code.bin").write_bytes(func_code)
+    (staging_path / "symbols.json").write_text(json.dumps({
+        name: dataclasses.astuple(symbol)
+        for name, symbol in symbols.items()
+    }))
+    
+    try:
+        staging_path.rename(BUILD_CACHE_DIR / key)
+    except OSError:
+        shutil.rmtree(staging_path, ignore_errors=True)
+    
+    cache_evict(max_size)
+
+
+def cache_evict(max_size: int) -> None:
+    entries: list[tuple[float, int, pathlib.Path]] = []
+    
+    for entry_path in BUILD_CACHE_DIR.iterdir():
+        if entry_path.name.startswith("."):
+            continue
+        
+        try:
+            size: int = sum(path.stat().st_size for path in entry_path.iterdir())
+            entries.append((entry_path.stat().st_mtime, size, entry_path))
+        except OSError:
+            continue
+    
+    total_size: int = sum(size for _, size, _ in entries)
+    
+    for _, size, entry_path in sorted(entries):
+        if total_size <= max_size:
+            break
+        
+        shutil.rmtree(entry_path, ignore_errors=True)
+        total_size -= size
+
+
+def parse_size(size: str) -> int:
+    units: dict[str, int] = dict(K=1 << 10, M=1 << 20, G=1 << 30)
+    
+    size = size.strip().upper().removesuffix("B")
+    if size and size[-1] in units:
+        return int(size[:-1]) * units[size[-1]]
+    
+    return int(size)
+
+
+@dataclasses.dataclass(frozen=True)
+class Symbol:
+    offs: int
+    size: int
+    section: str
+    kind: str
+
+
+ELF_SECTION_HEADER: typing.Final[struct.Struct] = struct.Struct("<IIQQQQIIQQ")
+ELF_SYMBOL: typing.Final[struct.Struct] = struct.Struct("<IBBHQQ")
+
+SHT_SYMTAB: typing.Final[int] = 2
+SHT_NOBITS: typing.Final[int] = 8
+SHF_ALLOC: typing.Final[int] = 0x2
+STB_LOCAL: typing.Final[int] = 0
+SYMBOL_KINDS: typing.Final[dict[int, str]] = {0: "notype", 1: "object", 2: "func"}
+
+
+def read_elf(elf: bytes) -> tuple[bytes, dict[str, Symbol]]:
+    """
+    Lays the allocated sections of a linked ELF out at their addresses, like
+    'objcopy -O binary' would, and reads its symbol table. Local symbols are only
+    kept when no global one has the same name.
+    """
+    
+    if elf[:6] != b"\x7fELF\x02\x01":
+        raise ValueError("Expected a little-endian 64-bit ELF from the linker")
+    
+    section_offs, = struct.unpack_from("<Q", elf, 0x28)
+    section_cnt, section_names_idx = struct.unpack_from("<HH", elf, 0x3c)
+    
+    sections: list[tuple[int, ...]] = [
+        ELF_SECTION_HEADER.unpack_from(elf, section_offs + idx * ELF_SECTION_HEADER.size)
+        for idx in range(section_cnt)
+    ]
+    
+    def read_name(table_idx: int, name_offs: int) -> str:
+        start: int = sections[table_idx][4] + name_offs
+        return elf[start:elf.index(b"\x00", start)].decode()
+    
+    section_names: list[str] = [read_name(section_names_idx, section[0]) for section in sections]
+    
+    image: bytearray = bytearray()
+    symbols: dict[str, Symbol] = {}
+    
+    for _, kind, flags, addr, offs, size, link, _, _, _ in sections:
+        if flags & SHF_ALLOC and kind != SHT_NOBITS and size:
+            image.extend(bytes(max(0, addr + size - len(image))))
+            image[addr:addr + size] = elf[offs:offs + size]
+        
+        if kind != SHT_SYMTAB:
+            continue
+        
+        for symbol_offs in range(offs, offs + size, ELF_SYMBOL.size):
+            name_offs, info, _, section_idx, value, symbol_size = ELF_SYMBOL.unpack_from(elf, symbol_offs)
+            
+            if not name_offs or (info & 0xf) not in SYMBOL_KINDS:
+                continue
+            
+            name: str = read_name(link, name_offs)
+            if name in symbols and info >> 4 == STB_LOCAL:
+                continue
+            
+            symbols[name] = Symbol(
+                offs=value,
+                size=symbol_size,
+                section=section_names[section_idx] if section_idx < section_cnt else "",
+                kind=SYMBOL_KINDS[info & 0xf],
+            )
+    
+    return bytes(image), symbols
+
+
+def is_function(symbols: dict[str, Symbol], name: str) -> bool:
+    return name in symbols and symbols[name].kind == "func" and symbols[name].size > 0
+
+
+CTYPES_NAMES: typing.Final[dict[str, str]] = {
+    "void": "None",
+    "_Bool": "ctypes.c_bool",
+    "bool": "ctypes.c_bool",
+    "char": "ctypes.c_char",
+    "signed char": "ctypes.c_byte",
+    "unsigned char": "ctypes.c_ubyte",
+    "short": "ctypes.c_short",
+    "unsigned short": "ctypes.c_ushort",
+    "int": "ctypes.c_int",
+    "unsigned": "ctypes.c_uint",
+    "unsigned int": "ctypes.c_uint",
+    "long": "ctypes.c_long",
+    "unsigned long": "ctypes.c_ulong",
+    "long long": "ctypes.c_longlong",
+    "unsigned long long": "ctypes.c_ulonglong",
+    "int8_t": "ctypes.c_int8",
+    "int16_t": "ctypes.c_int16",
+    "int32_t": "ctypes.c_int32",
+    "int64_t": "ctypes.c_int64",
+    "uint8_t": "ctypes.c_uint8",
+    "uint16_t": "ctypes.c_uint16",
+    "uint32_t": "ctypes.c_uint32",
+    "uint64_t": "ctypes.c_uint64",
+    "size_t": "ctypes.c_size_t",
+    "ssize_t": "ctypes.c_ssize_t",
+    "ptrdiff_t": "ctypes.c_ssize_t",
+    "float": "ctypes.c_float",
+    "double": "ctypes.c_double",
+}
+
+
+@dataclasses.dataclass
+class Param:
+    ctype: str
+    name: str
+    length_of: Param | None = None
+    # The pointee is const, so read-only buffers are fine
+    is_const: bool = False
+    
+    @property
+    def py_name(self) -> str:
+        return self.name + "_" if keyword.iskeyword(self.name) else self.name
+    
+    @property
+    def is_array(self) -> bool:
+        """
+        Pointers to numeric types accept any buffer, writable unless the pointee is const,
+        see `as_array` in the stub
+        """
+        
+        if not self.ctype.endswith("*"):
+            return False
+        
+        pointee: str = self.ctype[:-1].strip()
+        return pointee in CTYPES_NAMES and pointee not in ("void", "char")
+    
+    @property
+    def element_ctypes(self) -> str:
+        return ctype_to_ctypes(self.ctype[:-1].strip())
+    
+    @property
+    def element_kind(self) -> str:
+        """
+        The `format_kind` of the buffers this points into, `\\0` for ones without a kind
+        """
+        
+        return dict(signed="i", unsigned="u", float="f").get(fast_kind(self.ctype[:-1].strip()), "\\0")
+    
+    @property
+    def fast_kind(self) -> str:
+        return fast_kind(self.ctype)
+
+
+@dataclasses.dataclass
+class Export:
+    name: str
+    restype: str
+    params: list[Param]
+    
+    @property
+    def shim_name(self) -> str:
+        return f"__fastcall_{self.name}"
+    
+    @property
+    def fast_kind(self) -> str:
+        return fast_kind(self.restype)
+    
+    @property
+    def argtypes(self) -> list[str]:
+        return [ctype_to_ctypes(param.ctype) for param in self.params]
+    
+    @property
+    def restype_ctypes(self) -> str:
+        return ctype_to_ctypes(self.restype)
+    
+    @property
+    def has_arrays(self) -> bool:
+        return any(param.is_array for param in self.params)
+    
+    @property
+    def py_params(self) -> list[str]:
+        return [param.py_name for param in self.params if param.length_of is None]
+    
+    @property
+    def call_args(self) -> list[str]:
+        return [
+            param.py_name if param.length_of is None else f"{param.length_of.py_name}._length_"
+            for param in self.params
+        ]
+
+
+def normalize_ctype(ctype: str) -> str:
+    ctype = re.sub(r"\b(?:const|volatile|restrict|__restrict|static|inline|extern|EXPORTED)\b", " ", ctype)
+    ctype = re.sub(r"\s*\*\s*", "*", ctype)
+    ctype = re.sub(r"\s+", " ", ctype).strip()
+    ctype = re.sub(r"(?<=\w)\*", " *", ctype)
+    
+    return ctype
+
+
+def ctype_to_ctypes(ctype: str) -> str:
+    if ctype.endswith("*"):
+        pointee: str = ctype[:-1].strip()
+        
+        if pointee == "void":
+            return "ctypes.c_void_p"
+        if pointee == "char":
+            return "ctypes.c_char_p"
+        
+        return f"ctypes.POINTER({ctype_to_ctypes(pointee)})"
+    
+    if ctype not in CTYPES_NAMES:
+        raise ValueError(f"Unsupported type in an exported signature: '{ctype}'")
+    
+    return CTYPES_NAMES[ctype]
+
+
+def fast_kind(ctype: str) -> str:
+    """
+    Picks the Python API conversion used by the fast-call shims for a value of this type
+    """
+    
+    if ctype.endswith("*"):
+        return "pointer"
+    if ctype in ("void", "float", "double"):
+        return "void" if ctype == "void" else "float"
+    if ctype in ("_Bool", "bool"):
+        return "bool"
+    if ctype.startswith(("unsigned", "uint")) or ctype == "size_t":
+        return "unsigned"
+    
+    return "signed"
+
+
+def parse_params(params_text: str) -> list[Param]:
+    params_text = params_text.strip()
+    
+    if params_text in ("", "void"):
+        return []
+    
+    params: list[Param] = []
+    
+    for param_text in params_text.split(","):
+        match = re.fullmatch(r"\s*(?P<ctype>.*?[\s*])(?P<name>[a-zA-Z_]\w*)\s*", param_text)
+        
+        if not match:
+            raise ValueError(f"Can't parse parameter '{param_text.strip()}', only named scalar and pointer parameters are supported")
+        
+        ctype_text: str = match.group("ctype")
+        params.append(Param(
+            normalize_ctype(ctype_text),
+            match.group("name"),
+            # `const T *` or `T const *`, but not `T *const`
+            is_const="*" in ctype_text and re.search(r"\bconst\b", ctype_text.rpartition("*")[0]) is not None,
+        ))
+    
+    # A `size_t <name>_len` right after an array parameter is filled in automatically
+    for array, length in itertools.pairwise(params):
+        if array.is_array and length.ctype == "size_t" and length.name == f"{array.name}_len":
+            length.length_of = array
+    
+    return params
+
+
+def gather_exports(source_text: str, names: typing.Iterable[str]) -> list[Export]:
+    source_text = re.sub(r"/\*.*?\*/|//[^\n]*", " ", source_text, flags=re.DOTALL)
+    
+    signature_re: str = r"(?P<restype>[a-zA-Z_][\w\s*]*?[\s*])(?P<name>{name})\s*\((?P<params>[^()]*)\)\s*\{{"
+    
+    exports: dict[str, Export] = {}
+    
+    def add_export(match: re.Match) -> None:
+        exports[match.group("name")] = Export(
+            name=match.group("name"),
+            restype=normalize_ctype(match.group("restype")),
+            params=parse_params(match.group("params")),
+        )
+    
+    for match in re.finditer(
+        r"^[ \t]*EXPORTED\s+" + signature_re.format(name=r"[a-zA-Z_]\w*"),
+        source_text,
+        flags=re.MULTILINE,
+    ):
+        add_export(match)
+    
+    for name in names:
+        if name in exports:
+            continue
+        
+        match = re.search(r"^[ \t]*" + signature_re.format(name=re.escape(name)), source_text, flags=re.MULTILINE)
+        if not match:
+            raise ValueError(f"Can't find the definition of the exported function '{name}'")
+        
+        add_export(match)
+    
+    return list(exports.values())
+
+
+# Sections holding the pointers the stub fills in, and the libraries they are looked up in
+IMPORT_SECTIONS: typing.Final[dict[str, str | None]] = {
+    ".libc-imp": "libc.so.6",
+    ".libm-imp": "libm.so.6",
+    ".libpthread-imp": "libpthread.so.0",
+    # The interpreter itself, for the fast-call shims
+    ".pyapi-imp": None,
+}
+
+
+@dataclasses.dataclass
+class ImportTable:
+    library: str | None
+    offs: int
+    names: list[str]
+
+
+def gather_imports(symbols: dict[str, Symbol], section: str, library: str | None) -> ImportTable | None:
+    """
+    The pointer slots the stub patches, checked to be exactly pointer-sized and back to
+    back, so a mistyped declaration can't make the stub overwrite its neighbours
+    """
+    
+    slots: list[tuple[str, Symbol]] = sorted(
+        (
+            (name, symbol)
+            for name, symbol in symbols.items()
+            # Markers from the linker script land in the section as well
+            if symbol.section == section and symbol.kind != "notype"
+        ),
+        key=lambda slot: slot[1].offs,
+    )
+    
+    if not slots:
+        return None
+    
+    table: ImportTable = ImportTable(library, slots[0][1].offs, [])
+    
+    for name, symbol in slots:
+        if symbol.kind != "object" or symbol.size != 8:
+            raise ValueError(f"Import '{name}' in '{section}' must be a single pointer, got a {symbol.size}-byte {symbol.kind}")
+        if symbol.offs != table.offs + 8 * len(table.names):
+            raise ValueError(f"Import '{name}' in '{section}' isn't right after the previous one")
+        
+        table.names.append(import_name(name))
+    
+    return table
+
+
+def import_name(symbol: str) -> str:
+    """
+    The library function an import slot is named after. In C++ the runtime headers
+    declare theirs in the 'pack' namespace (see pack/pack.h), so they come mangled
+    """
+    
+    match: re.Match | None = re.fullmatch(r"_ZN4pack(\d+)(\w+)E", symbol)
+    if match is not None and int(match[1]) == len(match[2]):
+        return match[2]
     
-    return libc_relocs
+    return symbol
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+#pragma once
+
+#include "pack/pack.h"
+#ifdef PACK_HEAP
+#include "pack/mem.h"
+#endif
+
+
+PACK_BEGIN
+
+
+// Memory allocation for the rest of the runtime.
+//
+// By default malloc/realloc/free are imported from libc. When packed with
+// --heap-size (which defines PACK_HEAP), they become a bump allocator over one
+// large mapping that the stub reserves and describes in __pack_heap: no libc
+// calls, and pages are only touched once they are handed out. free() and
+// shrinking are only honored for the most recent allocation, and realloc()
+// of the most recent allocation grows it in place.
+
+
+#ifndef PACK_HEAP
+#pragma region Imports
+IMPORTED void *(*const volatile malloc)(size_t size) = NULL;
+IMPORTED void *(*const volatile realloc)(void *ptr, size_t size) = NULL;
+IMPORTED void (*const volatile free)(void *ptr) = NULL;
+#pragma endregion
+#else
+#pragma region Heap
+#define PACK_HEAP_ALIGN 16
+
+
+struct pack_heap {
+    char *cur;
+    char *end;
+};
+
+// Filled in by the stub, which looks it up by this plain name
+#ifdef __cplusplus
+extern "C" {
+#endif
+struct pack_heap __pack_heap;
+#ifdef __cplusplus
+}
+#endif
+
+
+// Every block is preceded by its (aligned) size, padded to keep the alignment
+struct pack_heap_header {
+    size_t size;
+    size_t _pad;
+};
+
+
+static inline size_t pack_heap_round(size_t size) {
+    return (size + PACK_HEAP_ALIGN - 1) & ~(size_t)(PACK_HEAP_ALIGN - 1);
+}
+
+
+static inline struct pack_heap_header *pack_heap_header(void *ptr) {
+    return (struct pack_heap_header *)ptr - 1;
+}
+
+
+static inline void *malloc(size_t size) {
+    size = pack_heap_round(size);
+
+    char *block = __pack_heap.cur;
+    if (__builtin_expect((size_t)(__pack_heap.end - block) < size + sizeof(struct pack_heap_header), 0)) {
+        __builtin_trap();
+    }
+
+    ((struct pack_heap_header *)block)->size = size;
+    __pack_heap.cur = block + sizeof(struct pack_heap_header) + size;
+    return block + sizeof(struct pack_heap_header);
+}
+
+
+static inline void free(void *ptr) {
+    if (!ptr) {
+        return;
+    }
+
+    if ((char *)ptr + pack_heap_header(ptr)->size == __pack_heap.cur) {
+        __pack_heap.cur = (char *)pack_heap_header(ptr);
+    }
+}
+
+
+static inline void *realloc(void *ptr, size_t size) {
+    if (!ptr) {
+        return malloc(size);
+    }
+
+    size = pack_heap_round(size);
+    size_t old_size = pack_heap_header(ptr)->size;
+
+    if ((char *)ptr + old_size == __pack_heap.cur) {
+        if (__builtin_expect((size_t)(__pack_heap.end - (char *)ptr) < size, 0)) {
+            __builtin_trap();
+        }
+
+        pack_heap_header(ptr)->size = size;
+        __pack_heap.cur = (char *)ptr + size;
+        return ptr;
+    }
+
+    if (size <= old_size) {
+        return ptr;
+    }
+
+    void *result = malloc(size);
+    memcpy(result, ptr, old_size);
+    return result;
+}
+#pragma endregion
+#endif
+
+
+PACK_END
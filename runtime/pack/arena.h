@@ -0,0 +1,48 @@
+#pragma once
+
+#include "pack/pack.h"
+#include "pack/alloc.h"
+
+
+PACK_BEGIN
+
+
+// Bump allocator for data that lives until the end of the run. Memory is taken
+// from malloc in large blocks and never given back individually.
+
+
+#ifndef ARENA_BLOCK_SIZE
+#define ARENA_BLOCK_SIZE ((size_t)1 << 20)
+#endif
+
+#define ARENA_ALIGN 16
+
+
+struct arena {
+    char *cur;
+    char *end;
+};
+
+
+static inline void *arena_alloc(struct arena *arena, size_t size) {
+    size = (size + ARENA_ALIGN - 1) & ~(size_t)(ARENA_ALIGN - 1);
+
+    if (__builtin_expect((size_t)(arena->end - arena->cur) < size, 0)) {
+        // The rest of the current block is abandoned
+        size_t block_size = size > ARENA_BLOCK_SIZE ? size : ARENA_BLOCK_SIZE;
+
+        arena->cur = (char *)malloc(block_size);
+        arena->end = arena->cur + block_size;
+    }
+
+    void *result = arena->cur;
+    arena->cur += size;
+    return result;
+}
+
+
+#define ARENA_NEW(ARENA, TYPE, COUNT) \
+    ((TYPE *)arena_alloc(&(ARENA), sizeof(TYPE) * (COUNT)))
+
+
+PACK_END
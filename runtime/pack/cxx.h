@@ -0,0 +1,155 @@
+#pragma once
+
+#include <new>
+
+#include "pack/pack.h"
+#include "pack/alloc.h"
+#include "pack/mem.h"
+
+
+// The parts of the C++ runtime that freestanding code still calls: new/delete
+// over pack/alloc.h, static destructors and the error paths of the standard
+// containers. Sources are built with -fno-exceptions, so errors that would
+// throw trap instead. Include this once, in the packed source.
+
+
+#ifndef CXX_ATEXIT_MAX
+#define CXX_ATEXIT_MAX 256
+#endif
+
+
+#pragma region Allocation
+void *operator new(size_t size) {
+    void *ptr = pack::malloc(size ? size : 1);
+    if (__builtin_expect(!ptr, 0)) {
+        __builtin_trap();
+    }
+
+    return ptr;
+}
+
+
+void *operator new[](size_t size) {
+    return operator new(size);
+}
+
+
+void *operator new(size_t size, const std::nothrow_t &) noexcept {
+    return pack::malloc(size ? size : 1);
+}
+
+
+void *operator new[](size_t size, const std::nothrow_t &) noexcept {
+    return pack::malloc(size ? size : 1);
+}
+
+
+void operator delete(void *ptr) noexcept {
+    pack::free(ptr);
+}
+
+
+void operator delete[](void *ptr) noexcept {
+    pack::free(ptr);
+}
+
+
+void operator delete(void *ptr, size_t) noexcept {
+    pack::free(ptr);
+}
+
+
+void operator delete[](void *ptr, size_t) noexcept {
+    pack::free(ptr);
+}
+#pragma endregion
+
+
+#pragma region Static objects
+// Static objects register their destructors here as they are constructed, and
+// cxx_run_atexit calls them in reverse. It is a destructor itself, which the
+// stub calls at interpreter exit
+static struct {
+    void (*func)(void *arg);
+    void *arg;
+} cxx_atexit_items[CXX_ATEXIT_MAX];
+static size_t cxx_atexit_cnt;
+
+
+extern "C" {
+// Weak, a hosted build (the --pgo one) gets it from crtbegin.o
+__attribute__((weak)) void *__dso_handle;
+
+
+int __cxa_atexit(void (*func)(void *arg), void *arg, void *dso_handle) {
+    (void)dso_handle;
+
+    if (cxx_atexit_cnt == CXX_ATEXIT_MAX) {
+        return -1;
+    }
+
+    cxx_atexit_items[cxx_atexit_cnt].func = func;
+    cxx_atexit_items[cxx_atexit_cnt].arg = arg;
+    cxx_atexit_cnt++;
+    return 0;
+}
+
+
+void __cxa_pure_virtual(void) {
+    __builtin_trap();
+}
+}
+
+
+__attribute__((destructor)) static void cxx_run_atexit(void) {
+    while (cxx_atexit_cnt) {
+        cxx_atexit_cnt--;
+        cxx_atexit_items[cxx_atexit_cnt].func(cxx_atexit_items[cxx_atexit_cnt].arg);
+    }
+}
+#pragma endregion
+
+
+#pragma region Standard library errors
+// Normally in libstdc++, which isn't linked
+namespace std {
+[[noreturn]] void __throw_bad_alloc(void) {
+    __builtin_trap();
+}
+
+
+[[noreturn]] void __throw_bad_array_new_length(void) {
+    __builtin_trap();
+}
+
+
+[[noreturn]] void __throw_length_error(const char *) {
+    __builtin_trap();
+}
+
+
+[[noreturn]] void __throw_logic_error(const char *) {
+    __builtin_trap();
+}
+
+
+[[noreturn]] void __throw_invalid_argument(const char *) {
+    __builtin_trap();
+}
+
+
+[[noreturn]] void __throw_out_of_range(const char *) {
+    __builtin_trap();
+}
+
+
+[[noreturn]] void __throw_out_of_range_fmt(const char *, ...) {
+    __builtin_trap();
+}
+
+
+[[noreturn]] void __throw_bad_function_call(void) {
+    __builtin_trap();
+}
+}
+#pragma endregion
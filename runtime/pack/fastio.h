@@ -0,0 +1,213 @@
+#pragma once
+
+#include "pack/pack.h"
+
+
+PACK_BEGIN
+
+
+// Bulk input and buffered output over raw file descriptors.
+//
+// The whole of stdin is taken in at once: a regular file is mapped directly,
+// anything else (a pipe, a terminal) is read into a lazily touched anonymous
+// mapping. Integers are then parsed straight from memory. The input always
+// ends with a NUL byte, which stops every scanning loop without extra bounds
+// checks.
+//
+// Output goes into a static buffer that is written out when full and by
+// output_flush(), which must be called before returning to Python.
+
+
+#pragma region Imports
+IMPORTED ptrdiff_t (*const volatile read)(int fd, void *buf, size_t count) = NULL;
+IMPORTED ptrdiff_t (*const volatile write)(int fd, const void *buf, size_t count) = NULL;
+IMPORTED int64_t (*const volatile lseek)(int fd, int64_t offset, int whence) = NULL;
+IMPORTED void *(*const volatile mmap)(void *addr, size_t length, int prot, int flags, int fd, int64_t offset) = NULL;
+#pragma endregion
+
+
+#pragma region Consts
+#ifndef FASTIO_INPUT_RESERVE
+// Upper bound on non-seekable input, only the pages actually read are touched
+#define FASTIO_INPUT_RESERVE ((size_t)1 << 30)
+#endif
+
+#ifndef FASTIO_OUTPUT_SIZE
+#define FASTIO_OUTPUT_SIZE ((size_t)1 << 16)
+#endif
+
+#define FASTIO_PAGE_SIZE 4096
+#define FASTIO_PROT_READ 0x1
+#define FASTIO_PROT_WRITE 0x2
+#define FASTIO_MAP_PRIVATE 0x02
+#define FASTIO_MAP_ANONYMOUS 0x20
+#define FASTIO_MAP_NORESERVE 0x4000
+#define FASTIO_MAP_FAILED ((void *)-1)
+#define FASTIO_SEEK_SET 0
+#define FASTIO_SEEK_CUR 1
+#define FASTIO_SEEK_END 2
+#pragma endregion
+
+
+#pragma region Input
+static const char *input_cur;
+
+
+static inline void input_read_all(void) {
+    char *buf = (char *)mmap(
+        NULL, FASTIO_INPUT_RESERVE,
+        FASTIO_PROT_READ | FASTIO_PROT_WRITE,
+        FASTIO_MAP_PRIVATE | FASTIO_MAP_ANONYMOUS | FASTIO_MAP_NORESERVE,
+        -1, 0
+    );
+    if (buf == FASTIO_MAP_FAILED) {
+        __builtin_trap();
+    }
+
+    size_t size = 0;
+    ptrdiff_t chunk;
+    // One byte is always left for the terminator, which the fresh mapping already holds
+    while (size + 1 < FASTIO_INPUT_RESERVE && (chunk = read(0, buf + size, FASTIO_INPUT_RESERVE - 1 - size)) > 0) {
+        size += chunk;
+    }
+
+    input_cur = buf;
+}
+
+
+static inline void input_init(void) {
+    int64_t offs = lseek(0, 0, FASTIO_SEEK_CUR);
+    int64_t size = lseek(0, 0, FASTIO_SEEK_END);
+
+    // The terminator comes from the zero fill past the end of the last page,
+    // so page-aligned files take the slow path
+    if (offs < 0 || size <= offs || size % FASTIO_PAGE_SIZE == 0) {
+        if (offs >= 0) {
+            lseek(0, offs, FASTIO_SEEK_SET);
+        }
+        input_read_all();
+        return;
+    }
+
+    const char *buf = (const char *)mmap(NULL, size, FASTIO_PROT_READ, FASTIO_MAP_PRIVATE, 0, 0);
+    if (buf == FASTIO_MAP_FAILED) {
+        lseek(0, offs, FASTIO_SEEK_SET);
+        input_read_all();
+        return;
+    }
+
+    input_cur = buf + offs;
+}
+
+
+static inline uint64_t read_uint64(void) {
+    if (__builtin_expect(!input_cur, 0)) {
+        input_init();
+    }
+
+    const char *cur = input_cur;
+
+    // Anything in 1..' ' is whitespace, the terminator stops the loop
+    while ((unsigned char)(*cur - 1) < ' ') {
+        ++cur;
+    }
+
+    uint64_t value = 0;
+    for (unsigned digit; (digit = (unsigned char)(*cur - '0')) < 10; ++cur) {
+        value = value * 10 + digit;
+    }
+
+    input_cur = cur;
+    return value;
+}
+
+
+static inline int64_t read_int64(void) {
+    if (__builtin_expect(!input_cur, 0)) {
+        input_init();
+    }
+
+    while ((unsigned char)(*input_cur - 1) < ' ') {
+        ++input_cur;
+    }
+
+    if (*input_cur == '-') {
+        ++input_cur;
+        return -(int64_t)read_uint64();
+    }
+
+    return (int64_t)read_uint64();
+}
+
+
+static inline int32_t read_int32(void) {
+    return (int32_t)read_int64();
+}
+#pragma endregion
+
+
+#pragma region Output
+static char output_buf[FASTIO_OUTPUT_SIZE];
+static size_t output_size;
+
+
+static inline void output_flush(void) {
+    for (size_t done = 0; done < output_size;) {
+        ptrdiff_t chunk = write(1, output_buf + done, output_size - done);
+        if (chunk <= 0) {
+            break;
+        }
+        done += chunk;
+    }
+
+    output_size = 0;
+}
+
+
+static inline void write_char(char value) {
+    if (__builtin_expect(output_size == FASTIO_OUTPUT_SIZE, 0)) {
+        output_flush();
+    }
+
+    output_buf[output_size++] = value;
+}
+
+
+static inline void write_uint64(uint64_t value) {
+    // Enough for any 64-bit number with a sign
+    if (__builtin_expect(output_size + 21 > FASTIO_OUTPUT_SIZE, 0)) {
+        output_flush();
+    }
+
+    char digits[20];
+    size_t digits_cnt = 0;
+
+    do {
+        digits[digits_cnt++] = '0' + value % 10;
+        value /= 10;
+    } while (value);
+
+    while (digits_cnt) {
+        output_buf[output_size++] = digits[--digits_cnt];
+    }
+}
+
+
+static inline void write_int64(int64_t value) {
+    if (value < 0) {
+        write_char('-');
+        write_uint64(-(uint64_t)value);
+        return;
+    }
+
+    write_uint64(value);
+}
+
+
+static inline void write_int32(int32_t value) {
+    write_int64(value);
+}
+#pragma endregion
+
+
+PACK_END
@@ -0,0 +1,137 @@
+#pragma once
+
+#include "pack/pack.h"
+#include "pack/alloc.h"
+
+
+PACK_BEGIN
+
+
+// Open-addressing hash map from int64 keys to int64 values. Linear probing
+// over a power-of-two table kept at most half full. HASHMAP_EMPTY_KEY marks
+// free slots and can't be used as a key.
+
+
+#define HASHMAP_EMPTY_KEY INT64_MIN
+
+
+struct hashmap_slot {
+    int64_t key;
+    int64_t value;
+};
+
+
+struct hashmap {
+    struct hashmap_slot *slots;
+    size_t size;
+    size_t mask;
+};
+
+
+static inline uint64_t hashmap_hash(int64_t key) {
+    // splitmix64 finalizer, so sequential keys don't cluster
+    uint64_t hash = (uint64_t)key;
+    hash = (hash ^ (hash >> 30)) * 0xbf58476d1ce4e5b9ull;
+    hash = (hash ^ (hash >> 27)) * 0x94d049bb133111ebull;
+    return hash ^ (hash >> 31);
+}
+
+
+static inline struct hashmap hashmap_new(size_t capacity) {
+    size_t slots_cnt = 16;
+    while (slots_cnt < capacity * 2) {
+        slots_cnt *= 2;
+    }
+
+    struct hashmap map = {
+        .slots = (struct hashmap_slot *)malloc(sizeof(struct hashmap_slot) * slots_cnt),
+        .size = 0,
+        .mask = slots_cnt - 1,
+    };
+
+    for (size_t i = 0; i < slots_cnt; ++i) {
+        map.slots[i].key = HASHMAP_EMPTY_KEY;
+    }
+
+    return map;
+}
+
+
+static inline struct hashmap_slot *hashmap_probe(const struct hashmap *map, int64_t key) {
+    size_t idx = hashmap_hash(key) & map->mask;
+
+    while (map->slots[idx].key != key && map->slots[idx].key != HASHMAP_EMPTY_KEY) {
+        idx = (idx + 1) & map->mask;
+    }
+
+    return &map->slots[idx];
+}
+
+
+// Returns a pointer to the value of `key`, or NULL if it is missing
+static inline int64_t *hashmap_find(const struct hashmap *map, int64_t key) {
+    struct hashmap_slot *slot = hashmap_probe(map, key);
+    return slot->key == key ? &slot->value : NULL;
+}
+
+
+static inline void hashmap_free(struct hashmap *map) {
+    free(map->slots);
+    map->slots = NULL;
+    map->size = 0;
+    map->mask = 0;
+}
+
+
+// Returns a pointer to the value of `key`, inserting it with `value` if it is missing
+static inline int64_t *hashmap_emplace(struct hashmap *map, int64_t key, int64_t value) {
+    if ((map->size + 1) * 2 > map->mask + 1) {
+        struct hashmap grown = hashmap_new(map->size + 1);
+
+        for (size_t i = 0; i <= map->mask; ++i) {
+            if (map->slots[i].key != HASHMAP_EMPTY_KEY) {
+                *hashmap_probe(&grown, map->slots[i].key) = map->slots[i];
+            }
+        }
+
+        grown.size = map->size;
+        hashmap_free(map);
+        *map = grown;
+    }
+
+    struct hashmap_slot *slot = hashmap_probe(map, key);
+
+    if (slot->key == HASHMAP_EMPTY_KEY) {
+        slot->key = key;
+        slot->value = value;
+        ++map->size;
+    }
+
+    return &slot->value;
+}
+
+
+static inline void hashmap_erase(struct hashmap *map, int64_t key) {
+    struct hashmap_slot *slot = hashmap_probe(map, key);
+    if (slot->key != key) {
+        return;
+    }
+
+    // Backward-shift deletion: pull later entries of the probe run into the
+    // hole, so no tombstones are needed
+    size_t hole = slot - map->slots;
+    for (size_t idx = (hole + 1) & map->mask; map->slots[idx].key != HASHMAP_EMPTY_KEY; idx = (idx + 1) & map->mask) {
+        size_t home = hashmap_hash(map->slots[idx].key) & map->mask;
+
+        if (((idx - home) & map->mask) >= ((idx - hole) & map->mask)) {
+            map->slots[hole] = map->slots[idx];
+            hole = idx;
+        }
+    }
+
+    map->slots[hole].key = HASHMAP_EMPTY_KEY;
+    --map->size;
+}
+
+
+PACK_END
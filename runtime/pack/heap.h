@@ -0,0 +1,95 @@
+#pragma once
+
+#include "pack/pack.h"
+#include "pack/vector.h"
+
+
+PACK_BEGIN
+
+
+// Binary min-heap of (key, value) pairs, ordered by key. Negate the keys for
+// a max-heap.
+
+
+struct heap_item {
+    int64_t key;
+    int64_t value;
+};
+
+
+struct heap {
+    struct vector items;
+};
+
+
+static inline struct heap heap_new(size_t capacity) {
+    return (struct heap){
+        .items = VECTOR_NEW(struct heap_item, capacity ? capacity : 1),
+    };
+}
+
+
+static inline size_t heap_size(const struct heap *heap) {
+    return heap->items.size;
+}
+
+
+static inline struct heap_item heap_top(const struct heap *heap) {
+    return VECTOR_ITEM(heap->items, struct heap_item, 0);
+}
+
+
+static inline void heap_push(struct heap *heap, int64_t key, int64_t value) {
+    VECTOR_PUSH_BACK(heap->items, struct heap_item, ((struct heap_item){.key = key, .value = value}));
+
+    struct heap_item *items = (struct heap_item *)heap->items.data;
+    struct heap_item item = items[heap->items.size - 1];
+    size_t idx = heap->items.size - 1;
+
+    // Sift up by moving parents down into the hole
+    while (idx > 0 && items[(idx - 1) / 2].key > item.key) {
+        items[idx] = items[(idx - 1) / 2];
+        idx = (idx - 1) / 2;
+    }
+
+    items[idx] = item;
+}
+
+
+static inline struct heap_item heap_pop(struct heap *heap) {
+    struct heap_item *items = (struct heap_item *)heap->items.data;
+    struct heap_item top = items[0];
+    struct heap_item item = items[--heap->items.size];
+    const size_t size = heap->items.size;
+    size_t idx = 0;
+
+    // Sift down by moving the smaller child up into the hole
+    while (2 * idx + 1 < size) {
+        size_t child = 2 * idx + 1;
+
+        if (child + 1 < size && items[child + 1].key < items[child].key) {
+            ++child;
+        }
+
+        if (items[child].key >= item.key) {
+            break;
+        }
+
+        items[idx] = items[child];
+        idx = child;
+    }
+
+    if (size > 0) {
+        items[idx] = item;
+    }
+
+    return top;
+}
+
+
+static inline void heap_free(struct heap *heap) {
+    VECTOR_FREE(heap->items);
+}
+
+
+PACK_END
@@ -0,0 +1,85 @@
+#pragma once
+
+#include "pack/pack.h"
+
+
+// memcpy/memmove/memset for freestanding code. GCC may emit calls to these on
+// its own (struct copies, loops it recognizes), so they are real external
+// definitions rather than static ones. They are written with `rep movsb`/
+// `rep stosb`, which are fast on anything with ERMS and which the compiler
+// can't turn back into calls to themselves.
+
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+
+void *memcpy(void *__restrict dest, const void *__restrict src, size_t count) {
+    void *result = dest;
+
+    __asm__ volatile (
+        "rep movsb"
+        : "+D"(dest), "+S"(src), "+c"(count)
+        :
+        : "memory"
+    );
+
+    return result;
+}
+
+
+void *memmove(void *dest, const void *src, size_t count) {
+    if ((uintptr_t)dest - (uintptr_t)src >= count) {
+        // No overlap that a forward copy would clobber
+        return memcpy(dest, src, count);
+    }
+
+    void *result = dest;
+    dest = (char *)dest + count - 1;
+    src = (const char *)src + count - 1;
+
+    __asm__ volatile (
+        "std\n\t"
+        "rep movsb\n\t"
+        "cld"
+        : "+D"(dest), "+S"(src), "+c"(count)
+        :
+        : "memory"
+    );
+
+    return result;
+}
+
+
+void *memset(void *dest, int value, size_t count) {
+    void *result = dest;
+
+    __asm__ volatile (
+        "rep stosb"
+        : "+D"(dest), "+c"(count)
+        : "a"(value)
+        : "memory"
+    );
+
+    return result;
+}
+
+
+int memcmp(const void *lhs, const void *rhs, size_t count) {
+    const unsigned char *lhs_c = (const unsigned char *)lhs;
+    const unsigned char *rhs_c = (const unsigned char *)rhs;
+
+    for (size_t i = 0; i < count; ++i) {
+        if (lhs_c[i] != rhs_c[i]) {
+            return lhs_c[i] < rhs_c[i] ? -1 : 1;
+        }
+    }
+
+    return 0;
+}
+
+
+#ifdef __cplusplus
+}
+#endif
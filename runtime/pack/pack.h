@@ -0,0 +1,28 @@
+#pragma once
+
+#include <stdint.h>
+#include <stddef.h>
+
+
+// Pointers to library functions, filled in by the generated stub.
+// Declare them as `IMPORTED ret (*const volatile name)(args) = NULL;`
+#define IMPORTED __attribute__((section(".libc-imp")))
+// Same, for functions from libm and libpthread
+#define IMPORTED_LIBM __attribute__((section(".libm-imp")))
+#define IMPORTED_LIBPTHREAD __attribute__((section(".libpthread-imp")))
+
+#ifdef __cplusplus
+// Functions exposed as Python callables by the generated stub
+#define EXPORTED extern "C" __attribute__((used))
+
+// The standard C++ headers declare the library functions themselves, which would
+// clash with the runtime's pointers of the same names. So in C++ the runtime lives
+// in a namespace, and the packer reads the names back from the mangled symbols
+#define PACK_BEGIN namespace pack {
+#define PACK_END } using namespace pack;
+#else
+#define EXPORTED __attribute__((used))
+
+#define PACK_BEGIN
+#define PACK_END
+#endif
@@ -0,0 +1,218 @@
+#pragma once
+
+#include "pack/pack.h"
+
+
+PACK_BEGIN
+
+
+// A small pool of worker threads for embarrassingly parallel loops.
+//
+// parallel_init(n) starts n - 1 workers (0 means one per online CPU), and the
+// calling thread takes part in every loop as the n-th. Calling it again before
+// parallel_shutdown keeps the running pool as it is. parallel_for(cnt, grain,
+// body, ctx) calls body(ctx, begin, end) over [0, cnt) split into ranges of
+// grain items, which the threads take in turn, and returns once all of them are
+// done. Before parallel_init, or with a single thread, it simply runs the loop.
+// There is a single pool, so loops started from different threads (e.g. exports
+// called by several Python threads under --nogil) run one after another.
+//
+// Bodies run concurrently, so they must not allocate: neither the bump malloc
+// of --heap-size nor arena_alloc is thread-safe. They must not start loops of
+// their own either, which would wait for the pool forever.
+//
+// The workers never touch Python, so they don't need the GIL. They block between
+// loops and are killed when the process exits, or stopped by parallel_shutdown.
+
+
+#ifndef PARALLEL_MAX_THREADS
+#define PARALLEL_MAX_THREADS 64
+#endif
+
+
+#pragma region Imports
+// glibc's x86-64 layouts. Zero-filled ones are the static initializers
+typedef struct { char opaque[40] __attribute__((aligned(8))); } parallel_mutex_t;
+typedef struct { char opaque[48] __attribute__((aligned(8))); } parallel_cond_t;
+
+IMPORTED_LIBPTHREAD int (*const volatile pthread_create)(uint64_t *thread, const void *attr, void *(*start)(void *arg), void *arg) = NULL;
+IMPORTED_LIBPTHREAD int (*const volatile pthread_join)(uint64_t thread, void **result) = NULL;
+IMPORTED_LIBPTHREAD int (*const volatile pthread_mutex_lock)(parallel_mutex_t *mutex) = NULL;
+IMPORTED_LIBPTHREAD int (*const volatile pthread_mutex_unlock)(parallel_mutex_t *mutex) = NULL;
+IMPORTED_LIBPTHREAD int (*const volatile pthread_cond_wait)(parallel_cond_t *cond, parallel_mutex_t *mutex) = NULL;
+IMPORTED_LIBPTHREAD int (*const volatile pthread_cond_broadcast)(parallel_cond_t *cond) = NULL;
+IMPORTED int (*const volatile get_nprocs)(void) = NULL;
+#pragma endregion
+
+
+typedef void (*parallel_body_t)(void *ctx, size_t begin, size_t end);
+
+
+static struct {
+    // Held for a whole loop, as the fields below only describe one at a time, and
+    // while the pool is started or stopped
+    parallel_mutex_t loop_mutex;
+    parallel_mutex_t mutex;
+    parallel_cond_t started;
+    parallel_cond_t finished;
+
+    size_t workers_cnt;
+    uint64_t workers[PARALLEL_MAX_THREADS];
+
+    // Bumped for every loop, and set to 0 to stop the workers
+    uint64_t generation;
+    size_t running_cnt;
+
+    parallel_body_t body;
+    void *ctx;
+    size_t cnt;
+    size_t grain;
+    size_t next;
+} __parallel_pool;
+
+
+static void parallel_run_ranges(void) {
+    size_t cnt = __parallel_pool.cnt;
+    size_t grain = __parallel_pool.grain;
+
+    for (;;) {
+        size_t begin = __atomic_fetch_add(&__parallel_pool.next, grain, __ATOMIC_RELAXED);
+        if (begin >= cnt) {
+            break;
+        }
+
+        __parallel_pool.body(__parallel_pool.ctx, begin, begin + grain < cnt ? begin + grain : cnt);
+    }
+}
+
+
+static void *parallel_worker(void *arg) {
+    (void)arg;
+    uint64_t seen = 1;
+
+    pthread_mutex_lock(&__parallel_pool.mutex);
+
+    for (;;) {
+        while (__parallel_pool.generation == seen) {
+            pthread_cond_wait(&__parallel_pool.started, &__parallel_pool.mutex);
+        }
+
+        if (!__parallel_pool.generation) {
+            break;
+        }
+
+        seen = __parallel_pool.generation;
+        pthread_mutex_unlock(&__parallel_pool.mutex);
+
+        parallel_run_ranges();
+
+        pthread_mutex_lock(&__parallel_pool.mutex);
+        if (--__parallel_pool.running_cnt == 0) {
+            pthread_cond_broadcast(&__parallel_pool.finished);
+        }
+    }
+
+    pthread_mutex_unlock(&__parallel_pool.mutex);
+    return NULL;
+}
+
+
+static inline size_t parallel_threads_cnt(void) {
+    return __parallel_pool.workers_cnt + 1;
+}
+
+
+static inline void parallel_init(size_t threads_cnt) {
+    pthread_mutex_lock(&__parallel_pool.loop_mutex);
+
+    // The workers remember the last generation they ran, restarting it would stall them
+    if (__parallel_pool.generation) {
+        pthread_mutex_unlock(&__parallel_pool.loop_mutex);
+        return;
+    }
+
+    if (!threads_cnt) {
+        threads_cnt = get_nprocs();
+    }
+    if (threads_cnt > PARALLEL_MAX_THREADS) {
+        threads_cnt = PARALLEL_MAX_THREADS;
+    }
+
+    __parallel_pool.generation = 1;
+
+    while (__parallel_pool.workers_cnt + 1 < threads_cnt) {
+        if (pthread_create(&__parallel_pool.workers[__parallel_pool.workers_cnt], NULL, parallel_worker, NULL) != 0) {
+            // Fewer threads is still correct
+            break;
+        }
+
+        __parallel_pool.workers_cnt++;
+    }
+
+    pthread_mutex_unlock(&__parallel_pool.loop_mutex);
+}
+
+
+static inline void parallel_for(size_t cnt, size_t grain, parallel_body_t body, void *ctx) {
+    if (!grain) {
+        grain = 1;
+    }
+
+    if (!__parallel_pool.workers_cnt || cnt <= grain) {
+        if (cnt) {
+            body(ctx, 0, cnt);
+        }
+        return;
+    }
+
+    pthread_mutex_lock(&__parallel_pool.loop_mutex);
+
+    // Another thread may have stopped the pool in the meantime
+    if (!__parallel_pool.workers_cnt) {
+        pthread_mutex_unlock(&__parallel_pool.loop_mutex);
+        body(ctx, 0, cnt);
+        return;
+    }
+
+    pthread_mutex_lock(&__parallel_pool.mutex);
+    __parallel_pool.body = body;
+    __parallel_pool.ctx = ctx;
+    __parallel_pool.cnt = cnt;
+    __parallel_pool.grain = grain;
+    __parallel_pool.next = 0;
+    __parallel_pool.running_cnt = __parallel_pool.workers_cnt;
+    __parallel_pool.generation++;
+    pthread_cond_broadcast(&__parallel_pool.started);
+    pthread_mutex_unlock(&__parallel_pool.mutex);
+
+    parallel_run_ranges();
+
+    pthread_mutex_lock(&__parallel_pool.mutex);
+    while (__parallel_pool.running_cnt) {
+        pthread_cond_wait(&__parallel_pool.finished, &__parallel_pool.mutex);
+    }
+    pthread_mutex_unlock(&__parallel_pool.mutex);
+
+    pthread_mutex_unlock(&__parallel_pool.loop_mutex);
+}
+
+
+static inline void parallel_shutdown(void) {
+    pthread_mutex_lock(&__parallel_pool.loop_mutex);
+
+    pthread_mutex_lock(&__parallel_pool.mutex);
+    __parallel_pool.generation = 0;
+    pthread_cond_broadcast(&__parallel_pool.started);
+    pthread_mutex_unlock(&__parallel_pool.mutex);
+
+    for (size_t i = 0; i < __parallel_pool.workers_cnt; i++) {
+        pthread_join(__parallel_pool.workers[i], NULL);
+    }
+
+    __parallel_pool.workers_cnt = 0;
+
+    pthread_mutex_unlock(&__parallel_pool.loop_mutex);
+}
+
+
+PACK_END
@@ -0,0 +1,85 @@
+#pragma once
+
+#include "pack/pack.h"
+#include "pack/alloc.h"
+#include "pack/mem.h"
+
+
+PACK_BEGIN
+
+
+// Growable array of items of any type. The item type is passed to every macro,
+// the vector itself only keeps raw bytes.
+
+
+struct vector {
+    void *data;
+    size_t size;
+    size_t capacity;
+};
+
+
+static inline void vector_reserve(struct vector *vector, size_t item_size, size_t capacity) {
+    if (vector->capacity >= capacity) {
+        return;
+    }
+
+    size_t new_capacity = vector->capacity ? vector->capacity : 1;
+    while (new_capacity < capacity) {
+        new_capacity *= 2;
+    }
+
+    // A single realloc no matter how far the capacity has to grow
+    vector->data = realloc(vector->data, item_size * new_capacity);
+    vector->capacity = new_capacity;
+}
+
+
+#define VECTOR_NEW(TYPE, CAPACITY) (struct vector){     \
+    .data = malloc(sizeof(TYPE) * (CAPACITY)),          \
+    .size = 0,                                          \
+    .capacity = (CAPACITY),                             \
+}
+
+
+#define VECTOR_ENSURE(VECTOR, TYPE, CAPACITY)           \
+    vector_reserve(&(VECTOR), sizeof(TYPE), (CAPACITY))
+
+
+#define VECTOR_PUSH_BACK(VECTOR, TYPE, VALUE) do {      \
+    if ((VECTOR).size == (VECTOR).capacity) {           \
+        VECTOR_ENSURE(VECTOR, TYPE, (VECTOR).size + 1); \
+    }                                                   \
+    ((TYPE *)(VECTOR).data)[(VECTOR).size++] = (VALUE); \
+} while (0)
+
+
+#define VECTOR_POP_BACK(VECTOR, TYPE)                   \
+    (((TYPE *)(VECTOR).data)[--(VECTOR).size])
+
+
+#define VECTOR_EXTEND(VECTOR, TYPE, OTHER) do {         \
+    VECTOR_ENSURE(VECTOR, TYPE,                         \
+                  (VECTOR).size + (OTHER).size);        \
+    memcpy(                                             \
+        (TYPE *)(VECTOR).data + (VECTOR).size,          \
+        (OTHER).data,                                   \
+        sizeof(TYPE) * (OTHER).size                     \
+    );                                                  \
+    (VECTOR).size += (OTHER).size;                      \
+} while (0)
+
+
+#define VECTOR_ITEM(VECTOR, TYPE, INDEX)                \
+    ((TYPE *)(VECTOR).data)[INDEX]
+
+
+#define VECTOR_FREE(VECTOR) do {                        \
+    free((VECTOR).data);                                \
+    (VECTOR).data = NULL;                               \
+    (VECTOR).size = 0;                                  \
+    (VECTOR).capacity = 0;                              \
+} while (0)
+
+
+PACK_END